@@ -0,0 +1,259 @@
+'''
+AIVAT-style win rate estimates from engine game logs, with far less variance than the raw deltas.
+
+Usage: python3 aivat.py <game log or - for stdin> [--player NAME] [--preflop-table PATH]
+       python3 aivat.py --check-chance
+'''
+from collections import namedtuple
+import importlib.util
+import argparse
+import json
+import math
+import sys
+
+from engine import *
+
+# one finished round: names, hands and deltas in seat order (small blind first), the board
+# cards that were dealt, and the actions in order
+HandRecord = namedtuple('HandRecord', ['names', 'hands', 'board', 'actions', 'deltas'])
+
+
+def read_hands(lines):
+    '''
+    Generates a HandRecord for every finished round in an engine game log. Lines that start
+    with '{' are read as JSON hand records instead, with card strings and action codes:
+    {"names": [...], "hands": [["Ah", "Kd"], [...]], "board": [...], "actions": ["C", "R6", ...], "deltas": [...]}
+    '''
+    names, hands, board, actions, deltas = [], [], [], [], []
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('{'):
+            record = json.loads(line)
+            yield HandRecord(record['names'], [[handeval.Card.new(card) for card in hand] for hand in record['hands']],
+                             [handeval.Card.new(card) for card in record['board']],
+                             [DECODE[code[0]](int(code[1:])) if code[0] == 'R' else DECODE[code[0]]() for code in record['actions']],
+                             record['deltas'])
+        elif line.endswith(' posts the blind of {}'.format(SMALL_BLIND)): #a new round
+            names, hands, board, actions, deltas = [line[:-len(' posts the blind of {}'.format(SMALL_BLIND))]], [], [], [], []
+        elif line.endswith(' posts the blind of {}'.format(BIG_BLIND)) and len(names) == 1:
+            names.append(line[:-len(' posts the blind of {}'.format(BIG_BLIND))])
+        elif len(names) == 2:
+            if line.split(' ', 1)[0] in STREET_NAMES:
+                board = [handeval.Card.new(card) for card in line.split(',', 1)[0].split(' ')[1:]]
+                continue
+            for name in sorted(names, key=len, reverse=True): #so a name that prefixes the other can't steal its lines
+                if not line.startswith(name + ' '):
+                    continue
+                event = line[len(name) + 1:]
+                if event.startswith('dealt '):
+                    hands.append([handeval.Card.new(card) for card in event[len('dealt '):].split(' ')])
+                elif event in ('folds', 'calls', 'checks'):
+                    actions.append({'folds': FoldAction, 'calls': CallAction, 'checks': CheckAction}[event]())
+                elif event.startswith('raises to ') or event.startswith('bets '):
+                    actions.append(RaiseAction(int(event.rsplit(' ', 1)[1])))
+                elif event.startswith('awarded '):
+                    deltas.append(int(event[len('awarded '):]))
+                    if len(deltas) == 2:
+                        yield HandRecord(names, hands, board, actions, deltas)
+                        names = []
+                break
+
+
+class AIVAT():
+    '''
+    Accumulates one player's payoffs with AIVAT control variates, which subtract the luck of
+    each chance event (the deal, flop, turn and river) and, given the known strategy of that
+    player, of their own randomised actions. Both corrections have expectation zero, so the
+    corrected mean is an unbiased estimate of the win rate.
+
+    The value of a state is the player's share of the pot at the current street's exact
+    equity, with both hands known, less what they have put in. Without a PreflopEquity table
+    the deal and flop are left uncorrected, since their expectations need preflop equities.
+    strategy(round_state, active) returns a list of (action, probability) pairs for the
+    player's decisions; not a dict, since FoldAction(), CallAction() and CheckAction() are
+    all equal empty tuples.
+    '''
+
+    def __init__(self, player, preflop_equity=None, strategy=None):
+        self.player = player
+        self.preflop_equity = preflop_equity
+        self.strategy = strategy
+        self.n = 0
+        self.sums = [0., 0.] #raw and corrected payoffs
+        self.squares = [0., 0.]
+
+    def equity(self, record, seat, street):
+        '''
+        Returns seat's exact equity against the other hand on a street, or None preflop
+        without a table.
+        '''
+        hand, opponent = record.hands[seat], record.hands[1-seat]
+        if street == 0:
+            return None if self.preflop_equity is None else self.preflop_equity.combo_equity(hand, opponent)
+        if street < 5:
+            return handeval.exact_equity(hand, record.board[:street], [opponent]).equity
+        ours, theirs = handeval.BoardContext(record.board).evaluate_hands([hand, opponent])
+        return 1. if ours < theirs else 0.5 if ours == theirs else 0.
+
+    @staticmethod
+    def value(state, seat, equity):
+        '''
+        Returns seat's value of a state at the given equity.
+        '''
+        if isinstance(state, TerminalState):
+            return state.deltas[seat]
+        contributions = [STARTING_STACK - stack for stack in state.stacks]
+        return equity * sum(contributions) - contributions[seat]
+
+    def corrected(self, record):
+        '''
+        Returns the player's raw and corrected payoffs for one hand.
+        '''
+        seat = record.names.index(self.player)
+        deck = handeval.IntDeck()
+        deck.cards = list(record.board) #showdowns only peek at the board
+        pips = [SMALL_BLIND, BIG_BLIND]
+        state = RoundState(0, 0, pips, [STARTING_STACK - SMALL_BLIND, STARTING_STACK - BIG_BLIND], record.hands, deck, None)
+        equities = {0: self.equity(record, seat, 0)}
+        correction = 0.
+        if equities[0] is not None: #the deal, against its expectation of 1/2
+            correction += (equities[0] - 0.5) * sum(pips)
+        for action in record.actions:
+            street = state.street
+            equity = equities[street]
+            if self.strategy is not None and state.button % 2 == seat and equity is not None:
+                expected = sum(probability * AIVAT.value(state.proceed(alternative), seat, equity)
+                               for alternative, probability in self.strategy(state, seat))
+                correction += AIVAT.value(state.proceed(action), seat, equity) - expected
+            state = state.proceed(action)
+            if isinstance(state, RoundState) and state.street != street: #cards dealt
+                equities[state.street] = self.equity(record, seat, state.street)
+                if equity is not None:
+                    correction += AIVAT.value(state, seat, equities[state.street]) - AIVAT.value(state, seat, equity)
+        delta = record.deltas[seat]
+        return delta, delta - correction
+
+    def add(self, record):
+        '''
+        Adds one hand to the estimate, skipping hands the player was not in.
+        '''
+        if self.player not in record.names:
+            return
+        for i, payoff in enumerate(self.corrected(record)):
+            self.sums[i] += payoff
+            self.squares[i] += payoff * payoff
+        self.n += 1
+
+    def estimates(self):
+        '''
+        Returns the raw and corrected win rates in mbb/hand, each with the half-width of its
+        95% confidence interval.
+        '''
+        results = []
+        for total, squares in zip(self.sums, self.squares):
+            mean = total / self.n
+            variance = max(squares - self.n * mean * mean, 0.) / (self.n - 1) if self.n > 1 else math.inf
+            results.append((1000 * mean / BIG_BLIND, 1000 * 1.96 * math.sqrt(variance / self.n) / BIG_BLIND))
+        return results
+
+    def report(self):
+        '''
+        Returns a summary of both estimates and the variance reduction.
+        '''
+        (raw, raw_error), (corrected, error) = self.estimates()
+        lines = ['{} over {} hands'.format(self.player, self.n),
+                 'Raw:   {:.1f} +/- {:.1f} mbb/hand (95% confidence)'.format(raw, raw_error),
+                 'AIVAT: {:.1f} +/- {:.1f} mbb/hand (95% confidence)'.format(corrected, error)]
+        if 0 < error < math.inf:
+            reduction = 1 - (error / raw_error) ** 2
+            lines.append('Variance reduced by {:.1f}%, worth {:.1f}x as many raw hands'.format(100 * reduction, (raw_error / error) ** 2))
+        return lines
+
+
+# hands and boards where the chance corrections must still average to zero, including ones
+# whose hole card ranks repeat on the board in suits the opponent's pair also spans
+CHANCE_CHECK_CASES = [
+    (['7h', '8h'], ['Ad', 'Kc'], ['7s', '8s', '2c', 'Kd']),
+    (['Ac', '5c'], ['Qc', 'Qd'], ['Ad', '5d', 'Kd', 'Kc']),
+    (['Kc', '7c'], ['Tc', 'Td'], ['Kd', '7d', '8s']),
+    (['Ah', 'Kc'], ['Qd', 'Qs'], ['Ac', 'Kh', '5d', '9s']),
+    (['Jc', '4c'], ['Td', '9d'], ['Jd', '4h', '8d']),
+]
+
+
+def chance_correction_mean(hand, opponent, board):
+    '''
+    Returns the mean change in hand's equity over every next card dealt to a flop or turn,
+    which the chance correction scales by the pot, so it must be 0.
+    '''
+    estimator = AIVAT(None)
+    hands = [[handeval.Card.new(card) for card in hand], [handeval.Card.new(card) for card in opponent]]
+    board = [handeval.Card.new(card) for card in board]
+    dead = set(board + hands[0] + hands[1])
+    record = HandRecord(None, hands, board, [], None)
+    before = estimator.equity(record, 0, len(board))
+    changes = [estimator.equity(record._replace(board=board + [card]), 0, len(board) + 1) - before
+               for card in handeval.CARD_INTS if card not in dead]
+    return sum(changes) / len(changes)
+
+
+def run_chance_check():
+    '''
+    Prints the mean chance correction for each of CHANCE_CHECK_CASES, returning whether they
+    are all 0.
+    '''
+    ok = True
+    for hand, opponent, board in CHANCE_CHECK_CASES:
+        mean = chance_correction_mean(hand, opponent, board)
+        ok = ok and abs(mean) < 1e-9
+        print('{} vs {} on {}: mean correction {:.2e}{}'.format(' '.join(hand), ' '.join(opponent), ' '.join(board),
+                                                                 mean, '' if abs(mean) < 1e-9 else '  BIASED'))
+    return ok
+
+
+def load_strategy(spec):
+    '''
+    Imports a strategy function given as path/to/file.py:function.
+    '''
+    path, function = spec.rsplit(':', 1)
+    spec = importlib.util.spec_from_file_location('_strategy', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, function)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python3 aivat.py')
+    parser.add_argument('log', nargs='?', help='Engine game log or JSON hand records, - for stdin')
+    parser.add_argument('--player', type=str, default=None, help='Player to estimate for, defaults to the first small blind')
+    parser.add_argument('--preflop-table', type=str, default=None,
+                        help='Table from python3 handeval.py preflop-table, to also correct the deal and flop')
+    parser.add_argument('--strategy', type=str, default=None,
+                        help='path/to/file.py:function giving the player\'s action probabilities')
+    parser.add_argument('--every', type=int, default=0, help='Also report after every this many hands')
+    parser.add_argument('--check-chance', action='store_true',
+                        help='Check that the flop and turn corrections average to 0, instead of reading a log')
+    args = parser.parse_args()
+    if args.check_chance:
+        sys.exit(0 if run_chance_check() else 1)
+    if args.log is None:
+        parser.error('the log argument is required')
+    preflop_equity = handeval.PreflopEquity(args.preflop_table) if args.preflop_table is not None else None
+    strategy = load_strategy(args.strategy) if args.strategy is not None else None
+    log_file = sys.stdin if args.log == '-' else open(args.log)
+    estimator = None
+    with log_file:
+        for record in read_hands(log_file):
+            if estimator is None:
+                estimator = AIVAT(args.player or record.names[0], preflop_equity, strategy)
+            estimator.add(record)
+            if args.every and estimator.n % args.every == 0:
+                print('\n'.join(estimator.report()) + '\n', flush=True)
+    if estimator is None or estimator.n == 0:
+        print('No hands found')
+        return
+    print('\n'.join(estimator.report()))
+
+
+if __name__ == '__main__':
+    main()
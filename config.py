@@ -9,6 +9,30 @@ PLAYER_2_PATH = './playground_bot'
 GAME_LOG_FILENAME = 'gamelog'
 # PLAYER_LOG_SIZE_LIMIT IS IN BYTES
 PLAYER_LOG_SIZE_LIMIT = 524288
+# OPTIONAL 7-CARD RANK TABLE FOR FASTER SHOWDOWNS, NONE TO DISABLE
+# GENERATE WITH: python3 handeval.py seven-table <path>
+SEVEN_CARD_TABLE = None
+# HEADLESS IMPORTS EACH BOT'S player.py AND CALLS IT DIRECTLY, WITHOUT
+# commands.json, SUBPROCESSES OR SOCKETS. PYTHON BOTS ONLY
+HEADLESS = False
+# DUPLICATE PLAYS EVERY DEAL TWICE, THE SECOND TIME WITH THE SEATS SWAPPED
+# AND THE BOTS RESTARTED, AND REPORTS THE COMBINED RESULT
+DUPLICATE = False
+# BINARY_PROTOCOL OFFERS BOTS A LENGTH-PREFIXED BINARY PROTOCOL AT CONNECT
+# BOTS THAT DO NOT ACCEPT IT KEEP USING TEXT
+BINARY_PROTOCOL = False
+# TRANSPORT IS 'tcp', 'unix' (A UNIX DOMAIN SOCKET) OR 'inherit' (A SOCKETPAIR
+# END PASSED TO THE BOT). 'unix' AND 'inherit' NEED AN UP TO DATE SKELETON
+TRANSPORT = 'tcp'
+# MULTI_TABLE HAS EACH BOT PLAY EVERY TABLE OF --tables FROM ONE PROCESS, WITH
+# BATCHED MESSAGES. BOTS WITHOUT AN UP TO DATE SKELETON GET ONE PROCESS PER TABLE
+MULTI_TABLE = False
+# FORK_SERVER STARTS EACH BOT ONCE PER --shards RUN OR TOURNAMENT, THEN FORKS
+# A WARM COPY OF IT FOR EVERY GAME. REUSE_BOTS KEEPS A BOT CONNECTED AFTER ITS
+# GAME AND RESETS IT FOR THE NEXT ONE IN THE SAME WORKER. BOTH NEED AN UP TO
+# DATE SKELETON, AND FORK_SERVER A UNIX-LIKE OS
+FORK_SERVER = False
+REUSE_BOTS = False
 # STARTING_GAME_CLOCK AND TIMEOUTS ARE IN SECONDS
 ENFORCE_GAME_CLOCK = False
 STARTING_GAME_CLOCK = 30000.
@@ -1,12 +1,28 @@
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from array import array
 from threading import Thread
 from queue import Queue
 import time
+import math
+import random
+import argparse
+import asyncio
 import json
+import struct
 import subprocess
 import socket
+import tempfile
+import shutil
+import signal
 import sys
 import os
+import io
+import contextlib
+import importlib.util
+import traceback
+import atexit
+import multiprocessing.util
 
 sys.path.append(os.getcwd())
 from config import *
@@ -18,13 +34,80 @@ CheckAction = namedtuple('CheckAction', [])
 # we coalesce BetAction and RaiseAction for convenience
 RaiseAction = namedtuple('RaiseAction', ['amount'])
 TerminalState = namedtuple('TerminalState', ['deltas', 'previous_state'])
+# one shard of a parallel match: player bankrolls in config order, PLAYER_1's delta each round, and the shard's log file
+MatchResult = namedtuple('MatchResult', ['bankrolls', 'deltas', 'log_filename'])
+FORK_SERVERS = {} #bot path to the address of its fork server, under FORK_SERVER (see Player.serve)
+IDLE_PLAYERS = {} #(name, path) to a connected bot this process kept from its last game, under REUSE_BOTS
 
 STREET_NAMES = ['Flop', 'Turn', 'River']
 DECODE = {'F': FoldAction, 'C': CallAction, 'K': CheckAction, 'R': RaiseAction}
-CCARDS = lambda cards: ','.join(map(str, cards)) #community cards
-PCARDS = lambda cards: '{}'.format(' '.join(map(str, cards)))
+ACTION_TYPES = {action.__name__: action for action in DECODE.values()} #in-process bots return their skeleton's own action classes
+CCARDS = lambda cards: ','.join(map(handeval.Card.int_to_str, cards)) #community cards
+PCARDS = lambda cards: '{}'.format(' '.join(map(handeval.Card.int_to_str, cards)))
 PVALUE = lambda name, value: ', {} ({})'.format(name, value)
 STATUS = lambda players: ''.join([PVALUE(p.name, p.bankroll) for p in players])
+# the binary protocol, offered at connect when BINARY_PROTOCOL is set. Bots that speak it echo the
+# offer back; older bots treat it as an empty packet and ack with a check, and stay on text.
+# Messages are a uint16 length then clauses, each its letter as one byte followed by
+# a float64 clock (T), a uint8 count and that many 0-51 card indices (H, B, O), an int32 (P, R, D)
+# or nothing (F, C, K, Q). The bot replies with one clause in the same framing.
+BINARY_OFFER = 'V1'
+# the multi-table extension, offered in text before the binary protocol as M and the number of
+# tables when MULTI_TABLE is set. Bots that speak it echo the offer back, then get batches of
+# messages for every table that is waiting on them, each message led by I and its table,
+# and reply with I and the table before each action. Q ends every table at once.
+TABLES_OFFER = 'M'
+FRAME = struct.Struct('<H')
+INT32 = struct.Struct('<i')
+DOUBLE = struct.Struct('<d')
+
+
+def encode_text(clause):
+    '''
+    Encodes one (code, value) message clause in the text protocol.
+    '''
+    code, value = clause
+    if value is None:
+        return code
+    if code == 'T':
+        return 'T{:.3f}'.format(value)
+    if isinstance(value, list): #cards
+        return code + CCARDS(value)
+    return code + str(value)
+
+
+def encode_binary(clauses):
+    '''
+    Encodes a list of (code, value) message clauses as one binary protocol frame.
+    '''
+    payload = bytearray()
+    for code, value in clauses:
+        payload += code.encode()
+        if code == 'T':
+            payload += DOUBLE.pack(value)
+        elif isinstance(value, list): #cards
+            payload.append(len(value))
+            payload += bytes([handeval.CARD_INT_TO_INDEX[card] for card in value])
+        elif value is not None:
+            payload += INT32.pack(value)
+    return FRAME.pack(len(payload)) + payload
+
+
+def decode_binary(payload):
+    '''
+    Decodes a binary protocol reply into a list of (code, amount) clauses.
+    '''
+    clauses = []
+    i = 0
+    while i < len(payload):
+        code = chr(payload[i])
+        i += 1
+        if code in 'RI':
+            clauses.append((code, INT32.unpack_from(payload, i)[0]))
+            i += INT32.size
+        else:
+            clauses.append((code, None))
+    return clauses
 
 
 class RoundState(namedtuple('_RoundState', ['button', 'street', 'pips', 'stacks', 'hands', 'deck', 'previous_state'])):
@@ -37,8 +120,7 @@ class RoundState(namedtuple('_RoundState', ['button', 'street', 'pips', 'stacks'
         '''
         Compares the players' hands and computes payoffs.
         '''
-        score0 = handeval.evaluate(self.deck.peek(5), self.hands[0]) #index 0 score
-        score1 = handeval.evaluate(self.deck.peek(5), self.hands[1]) #index 1 score
+        score0, score1 = handeval.BoardContext(self.deck.peek(5)).evaluate_hands(self.hands) #analyse the board once for both scores
         if score0 < score1:
             delta = STARTING_STACK - self.stacks[1] #index 0 won, so they get whatever index 1 bet
         elif score0 > score1:
@@ -126,11 +208,15 @@ class Player():
         self.commands = None 
         self.bot_subprocess = None
         self.socketfile = None
+        self.binary = False #whether the bot accepted the binary protocol
         self.bytes_queue = Queue() #this is for making sure we stay within size limits
+        self.log_filename = name + '.txt'
+        self.output_thread = None
+        self.pid = None #a bot forked by its fork server, which is not our subprocess
 
-    def build(self):
+    def load_commands(self):
         '''
-        Loads the commands file and builds the pokerbot.
+        Loads the commands file.
         '''
         try: #set the commands we have
             with open(self.path + '/commands.json', 'r') as json_file:
@@ -145,6 +231,12 @@ class Player():
             print(self.name, 'commands.json not found - check PLAYER_PATH')
         except json.decoder.JSONDecodeError:
             print(self.name, 'commands.json misformatted')
+
+    def build(self):
+        '''
+        Loads the commands file and builds the pokerbot.
+        '''
+        self.load_commands()
         if self.commands is not None and len(self.commands['build']) > 0: #if we have some commands to build the bot, do them in subprocess
             try:
                 proc = subprocess.run(self.commands['build'],
@@ -167,32 +259,38 @@ class Player():
         '''
         if self.commands is not None and len(self.commands['run']) > 0: #if we have commands to run, run in subprocess
             try:
-                server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                with server_socket:
-                    server_socket.bind(('', 0))
-                    server_socket.settimeout(CONNECT_TIMEOUT)
-                    server_socket.listen()
-                    port = server_socket.getsockname()[1]
-                    proc = subprocess.Popen(self.commands['run'] + [str(port)],
-                                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                            cwd=self.path)
-                    self.bot_subprocess = proc
-                    # function for bot listening
-                    def enqueue_output(out, queue):
-                        try:
-                            for line in out:
-                                queue.put(line)
-                        except ValueError:
-                            pass
-                    # start a separate bot listening thread which dies with the program
-                    Thread(target=enqueue_output, args=(proc.stdout, self.bytes_queue), daemon=True).start()
-                    # block until we timeout or the player connects
-                    client_socket, _ = server_socket.accept()
-                    with client_socket:
-                        client_socket.settimeout(CONNECT_TIMEOUT)
-                        sock = client_socket.makefile('rw')
-                        self.socketfile = sock
-                        print(self.name, 'connected successfully')
+                if self.path in FORK_SERVERS: #a warm copy of the bot is a fork away
+                    self.fork(FORK_SERVERS[self.path])
+                elif TRANSPORT == 'inherit': #hand the bot one end of a connected pair, no listening or accepting
+                    engine_socket, bot_socket = socket.socketpair()
+                    with bot_socket: #the bot has its own copy once started
+                        self.start(['--fd', str(bot_socket.fileno())], [bot_socket.fileno()])
+                    self.connect(engine_socket)
+                elif TRANSPORT == 'unix':
+                    directory = tempfile.mkdtemp()
+                    address = os.path.join(directory, 'bot.sock')
+                    try:
+                        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        with server_socket:
+                            server_socket.bind(address)
+                            server_socket.settimeout(CONNECT_TIMEOUT)
+                            server_socket.listen()
+                            self.start(['--unix', address])
+                            client_socket, _ = server_socket.accept()
+                            self.connect(client_socket)
+                    finally:
+                        shutil.rmtree(directory, ignore_errors=True)
+                else:
+                    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    with server_socket:
+                        server_socket.bind(('', 0))
+                        server_socket.settimeout(CONNECT_TIMEOUT)
+                        server_socket.listen()
+                        port = server_socket.getsockname()[1]
+                        self.start([str(port)])
+                        # block until we timeout or the player connects
+                        client_socket, _ = server_socket.accept()
+                        self.connect(client_socket)
             except (TypeError, ValueError):
                 print(self.name, 'run command misformatted')
             except OSError:
@@ -200,13 +298,119 @@ class Player():
             except socket.timeout:
                 print('Timed out waiting for', self.name, 'to connect')
 
+    def start(self, arguments, pass_fds=()):
+        '''
+        Starts the pokerbot subprocess with the given connection arguments.
+        '''
+        proc = subprocess.Popen(self.commands['run'] + arguments,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                cwd=self.path, pass_fds=pass_fds)
+        self.bot_subprocess = proc
+        self.drain(proc.stdout)
+
+    def drain(self, out):
+        '''
+        Copies the pokerbot's output into bytes_queue as it comes.
+        '''
+        # function for bot listening
+        def enqueue_output(out, queue):
+            try:
+                for line in out:
+                    queue.put(line)
+            except ValueError:
+                pass
+        # start a separate bot listening thread which dies with the program
+        self.output_thread = Thread(target=enqueue_output, args=(out, self.bytes_queue), daemon=True)
+        self.output_thread.start()
+
+    def fork(self, address):
+        '''
+        Asks the pokerbot's fork server for a copy of itself to play this game, with its output
+        sent back to us through a pipe, and connects to the copy.
+        '''
+        read_end, write_end = os.pipe()
+        client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client_socket.settimeout(CONNECT_TIMEOUT)
+            client_socket.connect(address)
+            socket.send_fds(client_socket, [b'F'], [write_end])
+            with client_socket.makefile('rb') as reply:
+                self.pid = int(reply.readline()) #the copy only speaks once spoken to
+        except (OSError, ValueError):
+            os.close(read_end)
+            client_socket.close()
+            raise
+        finally:
+            os.close(write_end)
+        self.drain(open(read_end, 'rb'))
+        self.connect(client_socket)
+
+    def serve(self):
+        '''
+        Runs the pokerbot as a fork server on a Unix domain socket it inherits. The server makes
+        its Player once, then forks a warm copy of itself for each game, so games skip the
+        imports and the Player's __init__. Returns the server's address, or None if it did not start.
+        '''
+        if self.commands is None or len(self.commands['run']) == 0:
+            return None
+        directory = tempfile.mkdtemp()
+        address = os.path.join(directory, 'fork.sock')
+        try:
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with listener:
+                listener.bind(address)
+                listener.listen()
+                self.start(['--serve', str(listener.fileno())], [listener.fileno()])
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket: #wait until it is serving
+                client_socket.settimeout(CONNECT_TIMEOUT)
+                client_socket.connect(address)
+                client_socket.sendall(b'P')
+                if client_socket.recv(1) == b'P':
+                    print(self.name, 'serving games')
+                    return address
+        except (TypeError, ValueError):
+            print(self.name, 'run command misformatted')
+        except socket.timeout:
+            print('Timed out waiting for', self.name, 'to serve games')
+        except OSError: #older skeletons exit on --serve, closing the socket
+            pass
+        if self.bot_subprocess is not None:
+            print(self.name, 'could not serve games - check its skeleton is up to date')
+        else:
+            print(self.name, 'run failed - check "run" in commands.json')
+        shutil.rmtree(directory, ignore_errors=True)
+        return None
+
+    def connect(self, client_socket):
+        '''
+        Sets up the socketfile on the pokerbot's connection.
+        '''
+        with client_socket:
+            client_socket.settimeout(CONNECT_TIMEOUT)
+            sock = client_socket.makefile('rw')
+            self.socketfile = sock
+            if BINARY_PROTOCOL:
+                self.negotiate(client_socket)
+            print(self.name, 'connected successfully')
+
+    def negotiate(self, client_socket):
+        '''
+        Offers the binary protocol, and switches to it if the pokerbot accepts.
+        '''
+        self.socketfile.write(BINARY_OFFER + '\n')
+        self.socketfile.flush()
+        if self.socketfile.readline().strip() == BINARY_OFFER: #older bots ack with a check instead
+            self.socketfile.close()
+            self.socketfile = client_socket.makefile('rwb')
+            self.binary = True
+
     def stop(self):
         '''
         Closes the socket connection and stops the pokerbot.
         '''
         if self.socketfile is not None: #if we have a socketfile
             try:
-                self.socketfile.write('Q\n') #write that the game is over
+                self.socketfile.write(encode_binary([('Q', None)]) if self.binary else 'Q\n') #write that the game is over
                 self.socketfile.close()
             except socket.timeout: #if player takes too long to disconnect
                 print('Timed out waiting for', self.name, 'to disconnect')
@@ -221,7 +425,53 @@ class Player():
                 self.bot_subprocess.kill() #kill subprocess
                 outs, _ = self.bot_subprocess.communicate() #get outputs up to that time
                 self.bytes_queue.put(outs)
-        with open(self.name + '.txt', 'wb') as log_file: #write player log file
+        elif self.pid is not None: #a forked bot quits by itself, closing its output
+            self.output_thread.join(CONNECT_TIMEOUT)
+            if self.output_thread.is_alive():
+                print('Timed out waiting for', self.name, 'to quit')
+                try:
+                    os.kill(self.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                self.output_thread.join()
+        self.write_log()
+
+    def reset(self):
+        '''
+        Asks the pokerbot to start a new game with a fresh Player on the same connection, and
+        clears its log for that game. Returns whether it did; older skeletons ack with a check.
+        '''
+        if self.socketfile is None or self.game_clock <= 0.:
+            return False
+        try:
+            self.socketfile.write(encode_binary([('N', None)]) if self.binary else 'N\n')
+            self.socketfile.flush()
+            code, _ = self.reply()
+        except (OSError, IndexError, struct.error):
+            return False
+        if code != 'N':
+            return False
+        self.game_clock = STARTING_GAME_CLOCK
+        self.bankroll = 0
+        with self.bytes_queue.mutex:
+            self.bytes_queue.queue.clear()
+        return True
+
+    def reply(self):
+        '''
+        Reads the pokerbot's reply to a message as a (code, amount) pair.
+        '''
+        if self.binary:
+            length, = FRAME.unpack(self.socketfile.read(FRAME.size))
+            return decode_binary(self.socketfile.read(length))[0]
+        clause = self.socketfile.readline().strip() #get rid of the spaces and read the top line
+        return clause[0], clause[1:]
+
+    def write_log(self):
+        '''
+        Writes the pokerbot's build and run output to its log file.
+        '''
+        with open(self.log_filename, 'wb') as log_file: #write player log file
             bytes_written = 0
             for output in self.bytes_queue.queue:
                 try:
@@ -232,7 +482,7 @@ class Player():
                     pass
         
 
-    def query(self, round_state, player_message, game_log):
+    def query(self, round_state, player_message, game_log, active):
         '''
         Requests one action from the pokerbot over the socket connection.
         At the end of the round, we request a CheckAction from the pokerbot.
@@ -240,29 +490,25 @@ class Player():
         legal_actions = round_state.legal_actions() if isinstance(round_state, RoundState) else {CheckAction} #get the possible legal actions
         if self.socketfile is not None and self.game_clock > 0.: #if we can communicate and there is still time
             try:
-                player_message[0] = 'T{:.3f}'.format(self.game_clock)
-                message = ' '.join(player_message) + '\n'
+                player_message[0] = ('T', self.game_clock)
+                if self.binary:
+                    message = encode_binary(player_message)
+                else:
+                    message = ' '.join(map(encode_text, player_message)) + '\n'
                 del player_message[1:]  # do not send redundant action history
                 start_time = time.perf_counter() #start timer
                 
                 self.socketfile.write(message) # write gameclock to socketfile
                 self.socketfile.flush() #commit that change
-                clause = self.socketfile.readline().strip() #get rid of the spaces and read the top line
+                code, amount = self.reply()
                 end_time = time.perf_counter() #end timer
                 if ENFORCE_GAME_CLOCK: #if we are timing, change the game clock
                     self.game_clock -= end_time - start_time
                 if self.game_clock <= 0.:
                     raise socket.timeout #socket timed out :|
-                action = DECODE[clause[0]] #decode the letter to the action
-                if action in legal_actions:
-                    if clause[0] == 'R': #if we are raising, and the raise is within bounds, then do it, otherwise check/fold
-                        amount = int(clause[1:])
-                        min_raise, max_raise = round_state.raise_bounds()
-                        if min_raise <= amount <= max_raise:
-                            return action(amount)
-                    else: #otherwise, we have 'C' or 'F' so just do that 
-                        return action()
-                game_log.append(self.name + ' attempted illegal ' + action.__name__) #if we tried an illegal action, put that in log
+                action = self.decode_action(code, amount, round_state, legal_actions, game_log)
+                if action is not None:
+                    return action
             except socket.timeout: #if we timed out, put in log and set clock to 0
                 error_message = self.name + ' ran out of time'
                 game_log.append(error_message)
@@ -273,11 +519,413 @@ class Player():
                 game_log.append(error_message)
                 print(error_message)
                 self.game_clock = 0.
-            except (IndexError, KeyError, ValueError): #if we misformat our response
+            except (IndexError, KeyError, ValueError, struct.error): #if we misformat our response
                 game_log.append(self.name + ' response misformatted')
         return CheckAction() if CheckAction in legal_actions else FoldAction() #default move is check/fold
 
-        
+    def decode_action(self, code, amount, round_state, legal_actions, game_log):
+        '''
+        Returns the action for a reply's code and amount, or None (noting it in the log) if it is illegal.
+        '''
+        action = DECODE[code] #decode the letter to the action
+        if action in legal_actions:
+            if code == 'R': #if we are raising, and the raise is within bounds, then do it, otherwise check/fold
+                amount = int(amount)
+                min_raise, max_raise = round_state.raise_bounds()
+                if min_raise <= amount <= max_raise:
+                    return action(amount)
+            else: #otherwise, we have 'C' or 'F' so just do that 
+                return action()
+        game_log.append(self.name + ' attempted illegal ' + action.__name__) #if we tried an illegal action, put that in log
+        return None
+
+
+class LocalPlayer():
+    '''
+    Runs one player's pokerbot inside the engine process, calling its Bot methods directly.
+    '''
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.game_clock = STARTING_GAME_CLOCK
+        self.bankroll = 0
+        self.bot_class = None
+        self.skeleton_states = None #the bot's own skeleton.states module, for GameState/RoundState/TerminalState
+        self.pokerbot = None
+        self.round_num = 1
+        self.round_flag = True #True until the bot has been told about the current round
+        self.views = {} #the bot's view of each RoundState this round, by id
+        self.output = io.StringIO() #whatever the bot prints, for its log file
+        self.log_filename = name + '.txt'
+
+    def build(self):
+        '''
+        Imports the Player class from the pokerbot's player.py.
+        '''
+        for module in [m for m in sys.modules if m == 'skeleton' or m.startswith('skeleton.')]:
+            del sys.modules[module] #each bot gets its own copy of its own skeleton
+        sys.path.insert(0, self.path)
+        try:
+            spec = importlib.util.spec_from_file_location('_bot_' + str(id(self)), os.path.join(self.path, 'player.py'))
+            module = importlib.util.module_from_spec(spec)
+            with contextlib.redirect_stdout(self.output):
+                spec.loader.exec_module(module)
+            self.bot_class = module.Player
+            self.skeleton_states = sys.modules['skeleton.states']
+        except FileNotFoundError:
+            print(self.name, 'player.py not found - check PLAYER_PATH')
+        except Exception: #anything the bot's own imports raise
+            traceback.print_exc(file=self.output)
+            print(self.name, 'build failed - could not import player.py')
+        finally:
+            sys.path.remove(self.path)
+
+    def run(self):
+        '''
+        Constructs the pokerbot.
+        '''
+        if self.bot_class is not None:
+            try:
+                with contextlib.redirect_stdout(self.output):
+                    self.pokerbot = self.bot_class()
+                print(self.name, 'loaded successfully')
+            except Exception:
+                traceback.print_exc(file=self.output)
+                print(self.name, 'run failed - Player() raised an exception')
+
+    def stop(self):
+        '''
+        Writes the pokerbot's output to its log file.
+        '''
+        with open(self.log_filename, 'wb') as log_file: #write player log file
+            log_file.write(self.output.getvalue().encode()[:PLAYER_LOG_SIZE_LIMIT])
+
+    def view(self, round_state, active, revealed=False):
+        '''
+        Converts an engine RoundState into the bot's own skeleton RoundState, as its Runner
+        would have rebuilt it: card strings, only the dealt board, and the opponent's hand
+        hidden unless revealed at showdown.
+        '''
+        key = (id(round_state), revealed)
+        if key not in self.views:
+            previous_state = None if round_state.previous_state is None else self.view(round_state.previous_state, active)
+            hands = [[], []]
+            for index in ([0, 1] if revealed else [active]):
+                hands[index] = [handeval.Card.int_to_str(card) for card in round_state.hands[index]]
+            board = [handeval.Card.int_to_str(card) for card in round_state.deck.peek(round_state.street)]
+            self.views[key] = self.skeleton_states.RoundState(round_state.button, round_state.street, list(round_state.pips),
+                                                              list(round_state.stacks), hands, board, previous_state)
+        return self.views[key]
+
+    def query(self, round_state, player_message, game_log, active):
+        '''
+        Requests one action from the pokerbot by calling it directly.
+        At the end of the round, we tell the pokerbot the outcome and return a CheckAction.
+        '''
+        del player_message[1:]  # the bot reads the RoundState instead of messages
+        legal_actions = round_state.legal_actions() if isinstance(round_state, RoundState) else {CheckAction} #get the possible legal actions
+        if self.pokerbot is not None and self.game_clock > 0.: #if the bot is loaded and there is still time
+            action = None
+            try:
+                GameState = self.skeleton_states.GameState
+                game_state = GameState(self.bankroll, float('{:.3f}'.format(self.game_clock)), self.round_num)
+                start_time = time.perf_counter() #start timer
+                with contextlib.redirect_stdout(self.output):
+                    if self.round_flag: #first time we see this round, so show the bot the initial state
+                        self.views = {}
+                        initial_state = round_state
+                        while initial_state.previous_state is not None:
+                            initial_state = initial_state.previous_state
+                        self.pokerbot.handle_new_round(game_state, self.view(initial_state, active), active)
+                        self.round_flag = False
+                    if isinstance(round_state, TerminalState):
+                        previous_state = round_state.previous_state
+                        showdown = FoldAction not in previous_state.legal_actions()
+                        terminal_state = self.skeleton_states.TerminalState(list(round_state.deltas),
+                                                                            self.view(previous_state, active, showdown))
+                        game_state = GameState(self.bankroll + round_state.deltas[active], game_state.game_clock, self.round_num)
+                        self.pokerbot.handle_round_over(game_state, terminal_state, active)
+                        self.round_num += 1
+                        self.round_flag = True
+                    else:
+                        action = self.pokerbot.get_action(game_state, self.view(round_state, active), active)
+                end_time = time.perf_counter() #end timer
+                if ENFORCE_GAME_CLOCK: #if we are timing, change the game clock
+                    self.game_clock -= end_time - start_time
+                if self.game_clock <= 0.:
+                    raise TimeoutError
+            except TimeoutError: #if we timed out, put in log and set clock to 0
+                error_message = self.name + ' ran out of time'
+                game_log.append(error_message)
+                print(error_message)
+                self.game_clock = 0.
+                action = None
+            except Exception: #the bot crashed, which over a socket would look like a disconnect
+                traceback.print_exc(file=self.output)
+                error_message = self.name + ' disconnected'
+                game_log.append(error_message)
+                print(error_message)
+                self.game_clock = 0.
+            if action is not None:
+                try:
+                    action_type = ACTION_TYPES[type(action).__name__] #the bot's action class to ours
+                    if action_type in legal_actions:
+                        if action_type is RaiseAction: #if we are raising, and the raise is within bounds, then do it, otherwise check/fold
+                            amount = int(action.amount)
+                            min_raise, max_raise = round_state.raise_bounds()
+                            if min_raise <= amount <= max_raise:
+                                return RaiseAction(amount)
+                        else:
+                            return action_type()
+                    game_log.append(self.name + ' attempted illegal ' + action_type.__name__) #if we tried an illegal action, put that in log
+                except (AttributeError, KeyError, TypeError, ValueError): #if we return something that is not an action
+                    game_log.append(self.name + ' response misformatted')
+        return CheckAction() if CheckAction in legal_actions else FoldAction() #default move is check/fold
+
+
+class AsyncPlayer(Player):
+    '''
+    Handles one player's pokerbot with asyncio subprocesses and streams, so that many tables can share one engine process.
+    '''
+
+    def __init__(self, name, path):
+        super().__init__(name, path)
+        self.reader = None
+        self.writer = None
+        self.drain_task = None #copies the bot's output into bytes_queue
+        self.tables = 1 #tables to offer the bot under MULTI_TABLE
+        self.multi = False #whether it plays them all from this connection
+        self.pending = [] #(table, message, future) of the tables waiting on the next batch
+        self.flusher = None
+
+    async def build(self):
+        '''
+        Loads the commands file and builds the pokerbot.
+        '''
+        self.load_commands()
+        if self.commands is not None and len(self.commands['build']) > 0:
+            try:
+                proc = await asyncio.create_subprocess_exec(*self.commands['build'],
+                                                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                            cwd=self.path)
+                try:
+                    outs, _ = await asyncio.wait_for(proc.communicate(), BUILD_TIMEOUT)
+                    self.bytes_queue.put(outs)
+                except asyncio.TimeoutError:
+                    error_message = 'Timed out waiting for ' + self.name + ' to build'
+                    print(error_message)
+                    proc.kill()
+                    self.bytes_queue.put(error_message.encode())
+            except (TypeError, ValueError):
+                print(self.name, 'build command misformatted')
+            except OSError:
+                print(self.name, 'build failed - check "build" in commands.json')
+
+    async def run(self):
+        '''
+        Runs the pokerbot and establishes the connection.
+        '''
+        if self.commands is not None and len(self.commands['run']) > 0:
+            try:
+                if TRANSPORT == 'inherit':
+                    engine_socket, bot_socket = socket.socketpair()
+                    with bot_socket:
+                        await self.start(['--fd', str(bot_socket.fileno())], [bot_socket.fileno()])
+                    self.reader, self.writer = await asyncio.open_connection(sock=engine_socket)
+                else:
+                    connected = asyncio.get_running_loop().create_future()
+                    def accept(reader, writer):
+                        if not connected.done():
+                            connected.set_result((reader, writer))
+                    directory = None
+                    if TRANSPORT == 'unix':
+                        directory = tempfile.mkdtemp()
+                        address = os.path.join(directory, 'bot.sock')
+                        server = await asyncio.start_unix_server(accept, path=address)
+                        arguments = ['--unix', address]
+                    else:
+                        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                        server_socket.bind(('', 0))
+                        server = await asyncio.start_server(accept, sock=server_socket)
+                        arguments = [str(server_socket.getsockname()[1])]
+                    try:
+                        await self.start(arguments)
+                        self.reader, self.writer = await asyncio.wait_for(connected, CONNECT_TIMEOUT)
+                    finally:
+                        server.close()
+                        if directory is not None:
+                            shutil.rmtree(directory, ignore_errors=True)
+                if self.tables > 1:
+                    offer = TABLES_OFFER + str(self.tables)
+                    self.writer.write((offer + '\n').encode())
+                    line = await asyncio.wait_for(self.reader.readline(), CONNECT_TIMEOUT)
+                    self.multi = line.strip() == offer.encode()
+                if BINARY_PROTOCOL:
+                    self.writer.write((BINARY_OFFER + '\n').encode())
+                    line = await asyncio.wait_for(self.reader.readline(), CONNECT_TIMEOUT)
+                    self.binary = line.strip() == BINARY_OFFER.encode()
+                print(self.name, 'connected successfully')
+            except (TypeError, ValueError):
+                print(self.name, 'run command misformatted')
+            except asyncio.TimeoutError:
+                print('Timed out waiting for', self.name, 'to connect')
+            except OSError:
+                print(self.name, 'run failed - check "run" in commands.json')
+
+    async def start(self, arguments, pass_fds=()):
+        '''
+        Starts the pokerbot subprocess with the given connection arguments.
+        '''
+        proc = await asyncio.create_subprocess_exec(*(self.commands['run'] + arguments),
+                                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                    cwd=self.path, pass_fds=pass_fds)
+        self.bot_subprocess = proc
+        async def enqueue_output(out, queue):
+            while True:
+                line = await out.readline()
+                if not line:
+                    break
+                queue.put(line)
+        self.drain_task = asyncio.ensure_future(enqueue_output(proc.stdout, self.bytes_queue))
+
+    async def stop(self):
+        '''
+        Closes the connection and stops the pokerbot.
+        '''
+        if self.writer is not None:
+            try:
+                self.writer.write(encode_binary([('Q', None)]) if self.binary else b'Q\n') #write that the game is over
+                await self.writer.drain()
+                self.writer.close()
+            except OSError:
+                print('Could not close socket connection with', self.name)
+        if self.bot_subprocess is not None:
+            try:
+                await asyncio.wait_for(self.bot_subprocess.wait(), CONNECT_TIMEOUT)
+            except asyncio.TimeoutError:
+                print('Timed out waiting for', self.name, 'to quit')
+                self.bot_subprocess.kill()
+                await self.bot_subprocess.wait()
+            await self.drain_task
+        self.write_log()
+
+    async def query(self, round_state, player_message, game_log, active):
+        '''
+        Requests one action from the pokerbot, awaiting its reply.
+        At the end of the round, we request a CheckAction from the pokerbot.
+        '''
+        legal_actions = round_state.legal_actions() if isinstance(round_state, RoundState) else {CheckAction}
+        if self.writer is not None and self.game_clock > 0.:
+            try:
+                player_message[0] = ('T', self.game_clock)
+                message = list(player_message)
+                del player_message[1:]  # do not send redundant action history
+                start_time = time.perf_counter() #includes any wait for the event loop, so only enforce clocks with few tables
+                code, amount = (await self.exchange(message))[0]
+                end_time = time.perf_counter()
+                if ENFORCE_GAME_CLOCK:
+                    self.game_clock -= end_time - start_time
+                if self.game_clock <= 0.:
+                    raise asyncio.TimeoutError
+                action = self.decode_action(code, amount, round_state, legal_actions, game_log)
+                if action is not None:
+                    return action
+            except asyncio.TimeoutError:
+                error_message = self.name + ' ran out of time'
+                game_log.append(error_message)
+                print(error_message)
+                self.game_clock = 0.
+            except asyncio.IncompleteReadError: #the bot closed the connection mid reply
+                error_message = self.name + ' disconnected'
+                game_log.append(error_message)
+                print(error_message)
+                self.game_clock = 0.
+            except OSError:
+                error_message = self.name + ' disconnected'
+                game_log.append(error_message)
+                print(error_message)
+                self.game_clock = 0.
+            except (IndexError, KeyError, ValueError, struct.error):
+                game_log.append(self.name + ' response misformatted')
+        return CheckAction() if CheckAction in legal_actions else FoldAction() #default move is check/fold
+
+    async def exchange(self, message):
+        '''
+        Sends the pokerbot one message and returns its reply as a list of (code, amount) clauses.
+        '''
+        if self.binary:
+            self.writer.write(encode_binary(message))
+        else:
+            self.writer.write((' '.join(map(encode_text, message)) + '\n').encode())
+        await self.writer.drain()
+        if self.binary:
+            length, = FRAME.unpack(await asyncio.wait_for(self.reader.readexactly(FRAME.size), CONNECT_TIMEOUT))
+            return decode_binary(await asyncio.wait_for(self.reader.readexactly(length), CONNECT_TIMEOUT))
+        line = (await asyncio.wait_for(self.reader.readline(), CONNECT_TIMEOUT)).decode().strip()
+        return [(clause[0], clause[1:]) for clause in line.split(' ')]
+
+    def batch(self, table, message):
+        '''
+        Queues one table's message for the next batch to a multi-table pokerbot. Returns a
+        future for that table's reply.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((table, message, future))
+        if self.flusher is None: #tables that queue before it runs join the same batch
+            self.flusher = asyncio.ensure_future(self.flush())
+        return future
+
+    async def flush(self):
+        '''
+        Sends the waiting tables' messages as one batch and hands each table its reply,
+        until no table is waiting.
+        '''
+        while self.pending:
+            pending, self.pending = self.pending, []
+            message = []
+            for table, clauses, _ in pending:
+                message.append(('I', table))
+                message.extend(clauses)
+            try:
+                replies = {}
+                table = None
+                for code, amount in await self.exchange(message):
+                    if code == 'I':
+                        table = int(amount)
+                    else:
+                        replies[table] = (code, amount)
+                for table, _, future in pending:
+                    if table in replies:
+                        future.set_result([replies[table]])
+                    else:
+                        future.set_exception(KeyError(table)) #no reply for this table
+            except Exception as error: #the batch failed, so every table in it did
+                for _, _, future in pending:
+                    future.set_exception(error)
+        self.flusher = None
+
+
+class TableSeat(AsyncPlayer):
+    '''
+    One table's seat for a multi-table AsyncPlayer, with its own bankroll and game clock,
+    whose queries go out in the host's batches.
+    '''
+
+    def __init__(self, host, table):
+        super().__init__(host.name, host.path)
+        self.host = host
+        self.table = table
+        self.writer = host.writer
+
+    async def stop(self):
+        '''
+        Leaves the table. The host stops the pokerbot after every table has finished.
+        '''
+        pass
+
+    async def exchange(self, message):
+        return await self.host.batch(self.table, message)
 
 
 class Game():
@@ -285,8 +933,9 @@ class Game():
     Manages logging and the high-level game procedure.
     '''
 
-    def __init__(self):
-        self.log = ['Cambridge University Algorithmic Games Society - AlgoPoker - ' + PLAYER_1_NAME + ' vs ' + PLAYER_2_NAME,
+    def __init__(self, rng=random, names=(PLAYER_1_NAME, PLAYER_2_NAME)):
+        self.rng = rng #shuffles the decks, so a seeded Random replays the same cards
+        self.log = ['Cambridge University Algorithmic Games Society - AlgoPoker - ' + names[0] + ' vs ' + names[1],
                     '---------------------------'
                     ]
         self.player_messages = [[], []]
@@ -301,16 +950,15 @@ class Game():
             self.log.append('{} posts the blind of {}'.format(players[1].name, BIG_BLIND))
             self.log.append('{} dealt {}'.format(players[0].name, PCARDS(round_state.hands[0])))
             self.log.append('{} dealt {}'.format(players[1].name, PCARDS(round_state.hands[1])))
-            self.player_messages[0] = ['T0.', 'P0', 'H' + CCARDS(round_state.hands[0])]
-            self.player_messages[1] = ['T0.', 'P1', 'H' + CCARDS(round_state.hands[1])]
+            self.player_messages[0] = [('T', 0.), ('P', 0), ('H', round_state.hands[0])]
+            self.player_messages[1] = [('T', 0.), ('P', 1), ('H', round_state.hands[1])]
         elif round_state.street > 0 and round_state.button == 1: #log cards on board and stack sizes
             board = round_state.deck.peek(round_state.street)
             self.log.append(STREET_NAMES[round_state.street - 3] + ' ' + PCARDS(board) +
                             PVALUE(players[0].name, STARTING_STACK-round_state.stacks[0]) +
                             PVALUE(players[1].name, STARTING_STACK-round_state.stacks[1]))
-            compressed_board = 'B' + CCARDS(board)
-            self.player_messages[0].append(compressed_board)
-            self.player_messages[1].append(compressed_board)
+            self.player_messages[0].append(('B', board))
+            self.player_messages[1].append(('B', board))
 
     def log_action(self, name, action, bet_override): #log player actions
         '''
@@ -318,19 +966,19 @@ class Game():
         '''
         if isinstance(action, FoldAction):
             phrasing = ' folds'
-            code = 'F'
+            clause = ('F', None)
         elif isinstance(action, CallAction):
             phrasing = ' calls'
-            code = 'C'
+            clause = ('C', None)
         elif isinstance(action, CheckAction):
             phrasing = ' checks'
-            code = 'K'
+            clause = ('K', None)
         else:  # isinstance(action, RaiseAction)
             phrasing = (' bets ' if bet_override else ' raises to ') + str(action.amount) #bet_override just phrases correctly
-            code = 'R' + str(action.amount)
+            clause = ('R', action.amount)
         self.log.append(name + phrasing)
-        self.player_messages[0].append(code)
-        self.player_messages[1].append(code)
+        self.player_messages[0].append(clause)
+        self.player_messages[1].append(clause)
     def log_terminal_state(self, players, round_state): #logs if at showdown and logs who was awarded what in any case
         '''
         Incorporates TerminalState information into the game log and player messages.
@@ -339,20 +987,20 @@ class Game():
         if FoldAction not in previous_state.legal_actions():
             self.log.append('{} shows {}'.format(players[0].name, PCARDS(previous_state.hands[0])))
             self.log.append('{} shows {}'.format(players[1].name, PCARDS(previous_state.hands[1])))
-            self.player_messages[0].append('O' + CCARDS(previous_state.hands[1]))
-            self.player_messages[1].append('O' + CCARDS(previous_state.hands[0]))
+            self.player_messages[0].append(('O', previous_state.hands[1]))
+            self.player_messages[1].append(('O', previous_state.hands[0]))
         self.log.append('{} awarded {}'.format(players[0].name, round_state.deltas[0]))
         self.log.append('{} awarded {}'.format(players[1].name, round_state.deltas[1]))
-        self.player_messages[0].append('D' + str(round_state.deltas[0]))
-        self.player_messages[1].append('D' + str(round_state.deltas[1]))
+        self.player_messages[0].append(('D', round_state.deltas[0]))
+        self.player_messages[1].append(('D', round_state.deltas[1]))
 
     def run_round(self, players):
         '''
         Runs one round of poker.
         '''
 
-        deck = handeval.Deck() #fresh deck of cards
-        deck.shuffle() #shuffle this deck
+        deck = handeval.IntDeck() #fresh deck of card ints, only turned into strings for logs and messages
+        deck.shuffle(self.rng) #shuffle this deck
         hands = [deck.deal(2), deck.deal(2)] #each player gets 2 cards
         pips = [SMALL_BLIND, BIG_BLIND] #first player in list small blind, second player big blind (we sorted out reversing in Game)
         stacks = [STARTING_STACK - SMALL_BLIND, STARTING_STACK - BIG_BLIND] #reflect pips in stack (same starting stack each time)
@@ -361,16 +1009,56 @@ class Game():
             self.log_round_state(players, round_state) #log at start of each round
             active = round_state.button % 2 #active player is number of alternations mod 2
             player = players[active]
-            action = player.query(round_state, self.player_messages[active], self.log) #ask the active player to move, send them the relevent info and a copy of the log
+            action = player.query(round_state, self.player_messages[active], self.log, active) #ask the active player to move, send them the relevent info and a copy of the log
             bet_override = (round_state.pips == [0, 0]) #do we say bet or raise in log
             self.log_action(player.name, action, bet_override)
             round_state = round_state.proceed(action) #advance game tree by the action that just came
         self.log_terminal_state(players, round_state)
-        for player, player_message, delta in zip(players, self.player_messages, round_state.deltas):
-            player.query(round_state, player_message, self.log) #tell player the outcome
+        for active, (player, player_message, delta) in enumerate(zip(players, self.player_messages, round_state.deltas)):
+            player.query(round_state, player_message, self.log, active) #tell player the outcome
             player.bankroll += delta #adjust bankroll by change 
         
 
+    def run_rounds(self, players, first_round, last_round):
+        '''
+        Runs rounds first_round to last_round, with the blinds alternating as if from round 1.
+        Returns the players in their final seat order and players[0]'s bankroll change in each round.
+        '''
+        first_player = players[0]
+        deltas = array('i')
+        if first_round % 2 == 0: #players[0] posted the small blind in round 1
+            players = players[::-1]
+        for round_num in range(first_round, last_round + 1): #loop each round, logging then reverse list for blinds
+            self.log.append('')
+            self.log.append('Round #' + str(round_num) + STATUS(players))
+            bankroll = first_player.bankroll
+            self.run_round(players)
+            deltas.append(first_player.bankroll - bankroll)
+            players = players[::-1]
+        return players, deltas
+
+    def run_duplicate(self, players, first_round, last_round):
+        '''
+        Plays rounds first_round to last_round twice from the same decks, the second time with
+        fresh copies of the bots in swapped seats, so each bot is dealt its opponent's cards.
+        Returns the second half's players in their final seat order, holding the combined
+        bankrolls, and players[0]'s combined bankroll change over each deal.
+        '''
+        seed = self.rng.getrandbits(64) #replaying this seed replays the decks
+        self.rng = random.Random(seed)
+        seats, first_deltas = self.run_rounds(players, first_round, last_round)
+        for player in seats:
+            player.stop()
+        fresh_players = [restart(player) for player in players] #so neither bot remembers the deals
+        self.log.append('')
+        self.log.append('')
+        self.log.append('Duplicate' + STATUS(players) + ' - replaying the deals with the seats swapped')
+        self.rng = random.Random(seed)
+        seats, second_deltas = self.run_rounds(fresh_players[::-1], first_round, last_round)
+        for player, first_half in zip(fresh_players, players):
+            player.bankroll += first_half.bankroll
+        return seats, array('i', [first - second for first, second in zip(first_deltas, second_deltas)])
+
     def run(self):
         '''
         Runs one game of poker.
@@ -385,18 +1073,21 @@ class Game():
 ╚═╝░░╚═╝╚══════╝░╚═════╝░░╚════╝░╚═╝░░░░░░╚════╝░╚═╝░░╚═╝╚══════╝╚═╝░░╚═╝''')
         print()
         print('Starting the AlgoPoker engine...')
+        player_class = LocalPlayer if HEADLESS else Player #headless bots run in this process, without sockets
         players = [
-            Player(PLAYER_1_NAME, PLAYER_1_PATH),
-            Player(PLAYER_2_NAME, PLAYER_2_PATH)
+            player_class(PLAYER_1_NAME, PLAYER_1_PATH),
+            player_class(PLAYER_2_NAME, PLAYER_2_PATH)
         ] #list of player objects
+        if SEVEN_CARD_TABLE is not None:
+            handeval.use_seven_card_table(SEVEN_CARD_TABLE)
+        handeval.warm_up() #build the hand lookup tables before any clocks start
         for player in players: #initialise each player bot
             player.build()
             player.run()
-        for round_num in range(1, NUM_ROUNDS + 1): #loop each round, logging then reverse list for blinds
-            self.log.append('')
-            self.log.append('Round #' + str(round_num) + STATUS(players))
-            self.run_round(players)
-            players = players[::-1]
+        if DUPLICATE:
+            players, _ = self.run_duplicate(players, 1, NUM_ROUNDS)
+        else:
+            players, _ = self.run_rounds(players, 1, NUM_ROUNDS)
         #log at the end
         self.log.append('')
         self.log.append('')
@@ -409,5 +1100,346 @@ class Game():
             log_file.write('\n'.join(self.log))
 
 
+class AsyncGame(Game):
+    '''
+    A Game whose rounds await their players' replies, so that many tables can run in one event loop.
+    '''
+
+    async def run_round(self, players):
+        '''
+        Runs one round of poker.
+        '''
+        deck = handeval.IntDeck()
+        deck.shuffle(self.rng)
+        hands = [deck.deal(2), deck.deal(2)]
+        pips = [SMALL_BLIND, BIG_BLIND]
+        stacks = [STARTING_STACK - SMALL_BLIND, STARTING_STACK - BIG_BLIND]
+        round_state = RoundState(0, 0, pips, stacks, hands, deck, None)
+        while not isinstance(round_state, TerminalState):
+            self.log_round_state(players, round_state)
+            active = round_state.button % 2
+            player = players[active]
+            action = await player.query(round_state, self.player_messages[active], self.log, active)
+            bet_override = (round_state.pips == [0, 0])
+            self.log_action(player.name, action, bet_override)
+            round_state = round_state.proceed(action)
+        self.log_terminal_state(players, round_state)
+        for active, (player, player_message, delta) in enumerate(zip(players, self.player_messages, round_state.deltas)):
+            await player.query(round_state, player_message, self.log, active)
+            player.bankroll += delta
+
+    async def run_rounds(self, players, first_round, last_round):
+        '''
+        Runs rounds first_round to last_round, as Game.run_rounds.
+        '''
+        first_player = players[0]
+        deltas = array('i')
+        if first_round % 2 == 0:
+            players = players[::-1]
+        for round_num in range(first_round, last_round + 1):
+            self.log.append('')
+            self.log.append('Round #' + str(round_num) + STATUS(players))
+            bankroll = first_player.bankroll
+            await self.run_round(players)
+            deltas.append(first_player.bankroll - bankroll)
+            players = players[::-1]
+        return players, deltas
+
+
+def run_shard(shard):
+    '''
+    Plays rounds first_round to last_round of a parallel match with a fresh pair of bots,
+    shuffling with a Random seeded by (seed, index). Returns a MatchResult.
+    '''
+    index, seed, first_round, last_round = shard
+    game = Game(random.Random('{}:{}'.format(seed, index)))
+    if SEVEN_CARD_TABLE is not None:
+        handeval.use_seven_card_table(SEVEN_CARD_TABLE)
+    handeval.warm_up()
+    bots = [] #in config order, while players is in seat order
+    for name, path in [(PLAYER_1_NAME, PLAYER_1_PATH), (PLAYER_2_NAME, PLAYER_2_PATH)]:
+        log_filename = '{}.{}.txt'.format(name, index) #one bot log per shard
+        if HEADLESS:
+            player = LocalPlayer(name, path)
+            player.log_filename = log_filename
+            player.build()
+            player.run()
+        else:
+            player = claim_player(name, path, log_filename)
+        bots.append(player)
+    game.log = [] #the merged log has the header
+    return play_rounds(game, bots, first_round, last_round, '{}.{}.txt'.format(GAME_LOG_FILENAME, index))
+
+
+def play_rounds(game, players, first_round, last_round, log_filename):
+    '''
+    Has game run rounds first_round to last_round between two running players, then stops
+    them and writes the game log. Returns a MatchResult, with bankrolls in the order of players.
+    In DUPLICATE matches each delta covers a deal played from both seats.
+    '''
+    if DUPLICATE:
+        seats, deltas = game.run_duplicate(players, first_round, last_round)
+    else:
+        seats, deltas = game.run_rounds(players, first_round, last_round)
+    for player in seats:
+        release_player(player)
+    with open(log_filename, 'w') as log_file:
+        log_file.write('\n'.join(game.log))
+    bankroll = sum(deltas)
+    return MatchResult([bankroll, -bankroll], deltas, log_filename)
+
+
+def claim_player(name, path, log_filename):
+    '''
+    Returns a running Player for a built bot: under REUSE_BOTS, the one this process kept from
+    its last game with that bot if there is one, and otherwise a new one.
+    '''
+    player = IDLE_PLAYERS.pop((name, path), None)
+    if player is None:
+        player = Player(name, path)
+        player.load_commands() #already built
+        player.run()
+    player.log_filename = log_filename
+    return player
+
+
+def release_player(player):
+    '''
+    Stops a player whose game is over, or under REUSE_BOTS keeps it connected for this
+    process's next claim_player, once it has written its log and been reset.
+    '''
+    key = (player.name, player.path)
+    if REUSE_BOTS and isinstance(player, Player) and key not in IDLE_PLAYERS:
+        player.write_log()
+        if player.reset():
+            player.log_filename = player.log_filename[:-len('.txt')] + '.idle.txt' #so stopping it keeps this game's log
+            IDLE_PLAYERS[key] = player
+            return
+    player.stop()
+
+
+def stop_idle_players():
+    '''
+    Stops every bot kept in IDLE_PLAYERS, which also writes their logs, once this process
+    will play no more games.
+    '''
+    while IDLE_PLAYERS:
+        _, player = IDLE_PLAYERS.popitem()
+        player.stop()
+
+
+def start_bot_worker(addresses):
+    '''
+    Sets up a worker process that keeps its bots between matches: has its Players fork from the
+    given servers, and stops its idle bots when it exits. Pool workers started by fork leave
+    without running atexit handlers, so the stop is also registered as a multiprocessing finalizer.
+    '''
+    use_fork_servers(addresses)
+    atexit.register(stop_idle_players)
+    multiprocessing.util.Finalize(None, stop_idle_players, exitpriority=0)
+
+
+def start_fork_servers(bots, log_directory=''):
+    '''
+    Starts built bots, given as (name, path), as fork servers. Returns the Players running the
+    servers and the FORK_SERVERS entries for those that started, to pass to use_fork_servers.
+    '''
+    servers, addresses = [], {}
+    for name, path in bots:
+        server = Player(name, path)
+        server.log_filename = os.path.join(log_directory, name + '.server.txt')
+        server.load_commands()
+        address = server.serve()
+        if address is not None:
+            servers.append(server)
+            addresses[path] = address
+        else: #its games start the bot as usual
+            server.stop()
+    return servers, addresses
+
+
+def use_fork_servers(addresses):
+    '''
+    Has this process's Players fork their bots from the given servers. Runs in each worker process.
+    '''
+    FORK_SERVERS.update(addresses)
+
+
+def stop_fork_servers(servers, addresses):
+    '''
+    Stops the fork servers from start_fork_servers once their games are over.
+    '''
+    for server in servers:
+        server.bot_subprocess.terminate()
+        server.stop()
+    for address in addresses.values():
+        shutil.rmtree(os.path.dirname(address), ignore_errors=True)
+
+
+def restart(player):
+    '''
+    Returns a fresh, running copy of a stopped player, which remembers nothing of its game.
+    '''
+    fresh_player = type(player)(player.name, player.path)
+    fresh_player.log_filename = player.log_filename[:-len('.txt')] + '.duplicate.txt'
+    if isinstance(fresh_player, Player):
+        fresh_player.load_commands() #already built
+    else:
+        fresh_player.build()
+    fresh_player.run()
+    return fresh_player
+
+
+def mbb_per_hand(deltas, hands=1):
+    '''
+    Returns the mean of chip deltas, each over the given number of hands (2 for duplicate
+    deals), in milli big blinds per hand, and the half-width of its 95% confidence interval.
+    '''
+    n = len(deltas)
+    mean = sum(deltas) / n
+    if n < 2:
+        return 1000 * mean / hands / BIG_BLIND, float('inf')
+    variance = sum((delta - mean) ** 2 for delta in deltas) / (n - 1)
+    return 1000 * mean / hands / BIG_BLIND, 1000 * 1.96 * math.sqrt(variance / n) / hands / BIG_BLIND
+
+
+def run_parallel(shards, workers=None, seed=None):
+    '''
+    Splits NUM_ROUNDS into shards, each played by its own engine instance and bot pair in a
+    process pool, then merges their logs into one game log and reports the result.
+    '''
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    print('Starting the AlgoPoker engine: {} rounds in {} shards, seed {}'.format(NUM_ROUNDS, shards, seed))
+    ranges = [(index, seed, NUM_ROUNDS * index // shards + 1, NUM_ROUNDS * (index + 1) // shards) for index in range(shards)]
+    bots = [(PLAYER_1_NAME, PLAYER_1_PATH), (PLAYER_2_NAME, PLAYER_2_PATH)]
+    servers, addresses = [], {}
+    if not HEADLESS:
+        for name, path in bots: #build each bot once for all shards
+            player = Player(name, path)
+            player.log_filename = name + '.build.txt'
+            player.build()
+            player.write_log()
+        if FORK_SERVER:
+            servers, addresses = start_fork_servers(bots)
+    with ProcessPoolExecutor(workers, initializer=start_bot_worker, initargs=(addresses,)) as executor: #workers keep their bots under REUSE_BOTS
+        merge_results(ranges, executor.map(run_shard, ranges), 'Shard')
+    stop_fork_servers(servers, addresses)
+
+
+def run_tables(tables, seed=None):
+    '''
+    Splits NUM_ROUNDS between tables that play at once in one asyncio event loop, each with its own
+    pair of bot subprocesses, decks and game clocks, then merges their logs and reports the result.
+    Under MULTI_TABLE, a bot that accepts plays every table from one subprocess instead.
+    Tables are seeded as run_parallel's shards, so the same seed deals the same cards.
+    '''
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    print('Starting the AlgoPoker engine: {} rounds at {} tables, seed {}'.format(NUM_ROUNDS, tables, seed))
+    ranges = [(index, seed, NUM_ROUNDS * index // tables + 1, NUM_ROUNDS * (index + 1) // tables) for index in range(tables)]
+    if SEVEN_CARD_TABLE is not None:
+        handeval.use_seven_card_table(SEVEN_CARD_TABLE)
+    handeval.warm_up()
+    async def play():
+        builds = [AsyncPlayer(PLAYER_1_NAME, PLAYER_1_PATH), AsyncPlayer(PLAYER_2_NAME, PLAYER_2_PATH)]
+        for player in builds: #build each bot once for all tables
+            player.log_filename = player.name + '.build.txt'
+            await player.build()
+            player.write_log()
+        hosts = []
+        if MULTI_TABLE:
+            hosts = [AsyncPlayer(PLAYER_1_NAME, PLAYER_1_PATH), AsyncPlayer(PLAYER_2_NAME, PLAYER_2_PATH)]
+            for host in hosts:
+                host.log_filename = host.name + '.0.txt' #it plays table 0 alone if it declines the others
+                host.tables = tables
+                host.load_commands()
+            await asyncio.gather(*[host.run() for host in hosts])
+        results = await asyncio.gather(*[play_table(*table, hosts) for table in ranges])
+        for host in hosts:
+            if host.multi:
+                host.log_filename = host.name + '.txt'
+                await host.stop()
+        return results
+    merge_results(ranges, asyncio.run(play()), 'Table')
+
+
+async def play_table(index, seed, first_round, last_round, hosts=()):
+    '''
+    Plays rounds first_round to last_round at one table of run_tables, seating any running
+    multi-table hosts rather than starting new bots. Returns a MatchResult.
+    '''
+    game = AsyncGame(random.Random('{}:{}'.format(seed, index)))
+    game.log = [] #the merged log has the header
+    players = []
+    starting = []
+    for number, (name, path) in enumerate([(PLAYER_1_NAME, PLAYER_1_PATH), (PLAYER_2_NAME, PLAYER_2_PATH)]):
+        if hosts and hosts[number].multi:
+            players.append(TableSeat(hosts[number], index))
+        elif hosts and index == 0:
+            players.append(hosts[number])
+        else:
+            player = AsyncPlayer(name, path)
+            player.log_filename = '{}.{}.txt'.format(name, index)
+            player.load_commands() #already built
+            players.append(player)
+            starting.append(player)
+    await asyncio.gather(*[player.run() for player in starting])
+    seats, deltas = await game.run_rounds(players, first_round, last_round)
+    await asyncio.gather(*[player.stop() for player in seats])
+    log_filename = '{}.{}.txt'.format(GAME_LOG_FILENAME, index)
+    with open(log_filename, 'w') as log_file:
+        log_file.write('\n'.join(game.log))
+    bankroll = sum(deltas)
+    return MatchResult([bankroll, -bankroll], deltas, log_filename)
+
+
+def merge_results(ranges, results, label):
+    '''
+    Merges the logs of the parts of a match, given their (index, seed, first_round, last_round)
+    ranges and MatchResults in the same order, into one game log, and reports the result.
+    '''
+    bankrolls = [0, 0]
+    deltas = array('i')
+    name = GAME_LOG_FILENAME + '.txt'
+    with open(name, 'w') as log_file:
+        log_file.write('Cambridge University Algorithmic Games Society - AlgoPoker - ' + PLAYER_1_NAME + ' vs ' + PLAYER_2_NAME +
+                       '\n---------------------------')
+        for (index, seed, first_round, last_round), result in zip(ranges, results):
+            print('{} {} (rounds {}-{}) finished'.format(label, index, first_round, last_round))
+            bankrolls = [total + bankroll for total, bankroll in zip(bankrolls, result.bankrolls)]
+            deltas.extend(result.deltas)
+            log_file.write('\n\n{} {}, seed {}'.format(label, index, seed)) #bankrolls in each part's log start from 0
+            with open(result.log_filename) as part_log:
+                for line in part_log:
+                    log_file.write(line)
+            os.remove(result.log_filename)
+        log_file.write('\n\n\nFinal' + PVALUE(PLAYER_1_NAME, bankrolls[0]) + PVALUE(PLAYER_2_NAME, bankrolls[1]))
+    hands = 2 if DUPLICATE else 1 #a duplicate deal is played once from each seat
+    mean, error = mbb_per_hand(deltas, hands)
+    print('Final' + PVALUE(PLAYER_1_NAME, bankrolls[0]) + PVALUE(PLAYER_2_NAME, bankrolls[1]))
+    print('{} wins {:.1f} +/- {:.1f} mbb/hand (95% confidence) over {} hands'.format(PLAYER_1_NAME, mean, error, len(deltas) * hands))
+    print('Wrote', name)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python3 engine.py')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Split NUM_ROUNDS between this many engine instances running in parallel')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to the number of CPUs')
+    parser.add_argument('--tables', type=int, default=1,
+                        help='Split NUM_ROUNDS between this many tables played at once in one event loop')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the shards\' or tables\' decks')
+    args = parser.parse_args()
+    if args.tables > 1 and (args.shards > 1 or HEADLESS or DUPLICATE):
+        parser.error('--tables runs bot subprocesses in one process, without --shards, HEADLESS or DUPLICATE')
+    if args.tables > 1:
+        run_tables(args.tables, args.seed)
+    elif args.shards > 1:
+        run_parallel(args.shards, args.workers, args.seed)
+    else:
+        Game().run()
+
+
 if __name__ == '__main__':
-    Game().run()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,16 +1,110 @@
 import random
 import itertools
+import functools
+import bisect
+import math
+import numbers
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import struct
+import zlib
+import mmap
+import sys
+import os
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
 SUITS = ['c', 'd', 'h', 's']
 
-def evaluate(board, hand):
-  board_cards = list(map(Card.new, board))
-  hand_cards = list(map(Card.new, hand))
+LOOKUP_TABLE_ENV = 'HANDEVAL_LOOKUP_TABLE'
 
-  e = Evaluator()
+_lookup_table = None
+_evaluator = None
 
-  return e.evaluate(board_cards, hand_cards)
+def evaluate(board, hand):
+  """
+  Ranks the hand on the board using the shared evaluator. Cards may be
+  given as strings ('Ah') or as ints already produced by Card.new, so
+  hot callers can convert once and skip the string parsing.
+  """
+  board_cards = to_card_ints(board)
+  hand_cards = to_card_ints(hand)
+
+  return get_evaluator().evaluate(board_cards, hand_cards)
+
+def to_card_ints(cards):
+  """
+  Converts a list of cards to int form, passing through ones that are
+  already ints, including NumPy integers such as IntDeck rows.
+  """
+  return [int(c) if isinstance(c, numbers.Integral) else Card.new(c) for c in cards]
+
+def evaluate_batch(boards, hands):
+  """
+  Ranks many hands at once with the shared evaluator, see
+  Evaluator.evaluate_batch.
+  """
+  return get_evaluator().evaluate_batch(boards, hands)
+
+def get_lookup_table():
+  """
+  Returns the process-wide LookupTable, building it on first use. If the
+  LOOKUP_TABLE_ENV environment variable names a file written by
+  `python3 handeval.py lookup-table`, it is loaded from there instead,
+  which also covers bot subprocesses and pool workers.
+  """
+  global _lookup_table
+  if _lookup_table is None:
+    filepath = os.environ.get(LOOKUP_TABLE_ENV)
+    _lookup_table = LookupTable.load(filepath) if filepath else LookupTable()
+  return _lookup_table
+
+def load_lookup_table(filepath):
+  """
+  Makes the table saved at filepath the process-wide LookupTable.
+  """
+  global _lookup_table
+  _lookup_table = LookupTable.load(filepath)
+  return _lookup_table
+
+def get_evaluator():
+  """
+  Returns the process-wide Evaluator, building it on first use.
+  """
+  global _evaluator
+  if _evaluator is None:
+    _evaluator = DirectEvaluator()
+  return _evaluator
+
+def set_evaluator(evaluator):
+  """
+  Replaces the shared evaluator, e.g. with a DirectEvaluator for bots
+  with tight memory limits.
+  """
+  global _evaluator
+  _evaluator = evaluator
+  return _evaluator
+
+def use_seven_card_table(filepath):
+  """
+  Switches the shared evaluator to the memory-mapped 7-card table
+  written by `python3 handeval.py seven-table`.
+  """
+  return set_evaluator(SevenCardEvaluator(filepath))
+
+def warm_up():
+  """
+  Builds the shared lookup tables now rather than on the first evaluate,
+  e.g. before a game clock starts running.
+  """
+  get_evaluator()
 
 class Deck:
   def __init__(self):
@@ -39,6 +133,60 @@ class Deck:
     return self.cards[:n]
 
 
+class IntDeck:
+  """
+  Deck of cards as ints, either 0-51 deck indices (encoding='index') or
+  Card.new ints (encoding='card'), in the same order as Deck. Dealing moves
+  a cursor rather than deleting from the list, so deal and peek only copy
+  the cards they return. Convert with Card.int_to_str (or CARD_INTS first,
+  for indices) where strings are needed.
+  """
+
+  def __init__(self, encoding='card'):
+    if encoding == 'card':
+      self.cards = list(CARD_INTS)
+    elif encoding == 'index':
+      self.cards = list(range(52))
+    else:
+      raise ValueError("Unknown deck encoding: " + str(encoding))
+    self.encoding = encoding
+    self.position = 0
+
+  def shuffle(self, rng=random):
+    rng.shuffle(self.cards)
+    self.position = 0
+
+  def deal(self, n):
+    if n > len(self.cards) - self.position:
+      raise ValueError("Insufficient cards in deck")
+
+    dealt = self.cards[self.position:self.position + n]
+    self.position += n
+
+    return dealt
+
+  def peek(self, n):
+    if n > len(self.cards) - self.position:
+      raise ValueError("Insufficient cards in deck")
+
+    return self.cards[self.position:self.position + n]
+
+  @staticmethod
+  def shuffled_decks(n, encoding='index', seed=None):
+    """
+    Returns n independently shuffled decks as an (n, 52) NumPy array, for
+    simulators that deal many rounds at once.
+    """
+    if np is None:
+      raise ImportError("shuffled_decks requires numpy")
+
+    rng = np.random.default_rng(seed)
+    decks = rng.permuted(np.tile(np.arange(52, dtype=np.int64), (n, 1)), axis=1)
+    if encoding == 'card':
+      return np.array(CARD_INTS, dtype=np.int64)[decks]
+    return decks
+
+
 
 class Card:
     """
@@ -246,6 +394,23 @@ class Card:
         return output
 
 
+# Card ints in Deck order, so a 0-51 deck index maps to CARD_INTS[index]
+CARD_INTS = [Card.new(rank + suit) for rank in RANKS for suit in SUITS]
+CARD_INT_TO_INDEX = {c: i for i, c in enumerate(CARD_INTS)}
+
+# every two card holding as a pair of deck indices, in a fixed order which
+# gives each of the 1326 combos its combo index
+COMBOS = list(itertools.combinations(range(52), 2))
+COMBO_TO_INDEX = {combo: i for i, combo in enumerate(COMBOS)}
+
+def combo_index(hand):
+  """
+  Returns the combo index in [0, 1326) of two hole cards (strings or ints).
+  """
+  i, j = sorted(CARD_INT_TO_INDEX[c] for c in to_card_ints(hand))
+  return COMBO_TO_INDEX[(i, j)]
+
+
 class LookupTable(object):
     """
     Number of Distinct Hand Values:
@@ -288,6 +453,10 @@ class LookupTable(object):
         MAX_HIGH_CARD: 9
     }
 
+    MAGIC = b'HELT'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIIII')
+
     RANK_CLASS_TO_STRING = {
         1: "Straight Flush",
         2: "Four of a Kind",
@@ -488,14 +657,85 @@ class LookupTable(object):
                 self.unsuited_lookup[product] = rank
                 rank += 1
 
+    def batch_arrays(self):
+        """
+        Returns NumPy versions of the lookups for batched evaluation:
+            flush_ranks: 13 bit rank mask => flush rank
+            prime_keys: sorted unsuited prime products
+            prime_ranks: unsuited rank of each entry of prime_keys
+        Built on first use.
+        """
+        if getattr(self, '_batch_arrays', None) is None:
+            flush_ranks = np.zeros(1 << 13, dtype=np.int32)
+            for prime_product, rank in self.flush_lookup.items():
+                mask = 0
+                for i in Card.INT_RANKS:
+                    if prime_product % Card.PRIMES[i] == 0:
+                        mask |= 1 << i
+                flush_ranks[mask] = rank
+
+            prime_keys = np.array(sorted(self.unsuited_lookup), dtype=np.int32)
+            prime_ranks = np.array([self.unsuited_lookup[k] for k in prime_keys.tolist()], dtype=np.int32)
+            self._batch_arrays = (flush_ranks, prime_keys, prime_ranks)
+
+        return self._batch_arrays
+
     def write_table_to_disk(self, table, filepath):
         """
         Writes lookup table to disk
         """
         with open(filepath, 'w') as f:
-            for prime_prod, rank in table.iteritems():
+            for prime_prod, rank in table.items():
                 f.write(str(prime_prod) + "," + str(rank) + '\n')
 
+    def save(self, filepath):
+        """
+        Writes both lookups to a binary file that load reads back far
+        faster than they can be regenerated.
+        File layout (little endian int32s after a 20 byte header):
+            header:   magic 'HELT', version, len(flush_lookup),
+                      len(unsuited_lookup), crc32 of the rest
+            flush:    prime products, then their ranks
+            unsuited: prime products, then their ranks
+        """
+        payload = array('i')
+        for lookup in (self.flush_lookup, self.unsuited_lookup):
+            keys = sorted(lookup)
+            payload.extend(keys)
+            payload.extend(lookup[k] for k in keys)
+        if sys.byteorder != 'little':
+            payload.byteswap()
+        data = payload.tobytes()
+
+        with open(filepath, 'wb') as f:
+            f.write(LookupTable.HEADER.pack(LookupTable.MAGIC, LookupTable.VERSION, len(self.flush_lookup),
+                                            len(self.unsuited_lookup), zlib.crc32(data)))
+            f.write(data)
+
+    @staticmethod
+    def load(filepath):
+        """
+        Reads a table written by save, checking its version and checksum.
+        """
+        with open(filepath, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, version, num_flush, num_unsuited, checksum = LookupTable.HEADER.unpack_from(data)
+                if magic != LookupTable.MAGIC or version != LookupTable.VERSION:
+                    raise ValueError("Not a version {} lookup table: {}".format(LookupTable.VERSION, filepath))
+                if zlib.crc32(data[LookupTable.HEADER.size:]) != checksum:
+                    raise ValueError("Lookup table checksum mismatch: {}".format(filepath))
+
+                payload = array('i')
+                payload.frombytes(data[LookupTable.HEADER.size:])
+        if sys.byteorder != 'little':
+            payload.byteswap()
+
+        table = LookupTable.__new__(LookupTable)
+        flush_end = 2 * num_flush
+        table.flush_lookup = dict(zip(payload[:num_flush], payload[num_flush:flush_end]))
+        table.unsuited_lookup = dict(zip(payload[flush_end:flush_end + num_unsuited], payload[flush_end + num_unsuited:]))
+        return table
+
     def get_lexographically_next_bit_sequence(self, bits):
         """
         Bit hack from here:
@@ -512,6 +752,47 @@ class LookupTable(object):
             yield next
 
 
+# hand rank => rank class, and hand rank => rank percentage, for every rank
+# in [0, 7462] (0 is not a real rank, but get_rank_class has always taken it)
+RANK_CLASSES = [0] * (LookupTable.MAX_HIGH_CARD + 1)
+_rank = 0
+for _max_rank in sorted(LookupTable.MAX_TO_RANK_CLASS):
+  while _rank <= _max_rank:
+    RANK_CLASSES[_rank] = LookupTable.MAX_TO_RANK_CLASS[_max_rank]
+    _rank += 1
+RANK_PERCENTAGES = [float(r) / float(LookupTable.MAX_HIGH_CARD) for r in range(LookupTable.MAX_HIGH_CARD + 1)]
+# rank class => name, with nothing at the unused class 0
+CLASS_STRINGS = [''] + [LookupTable.RANK_CLASS_TO_STRING[c] for c in range(1, 10)]
+
+_rank_array_cache = None
+
+def _checked_array(values, low, high, name):
+  """
+  Returns values as a NumPy integer array for indexing the rank arrays,
+  raising ValueError if any is outside [low, high], since NumPy would wrap
+  negative indices around instead of failing.
+  """
+  values = np.asarray(values)
+  if values.dtype.kind not in 'iu':
+    raise ValueError("Invalid {}s, expected integers".format(name))
+  if ((values < low) | (values > high)).any():
+    raise ValueError("Invalid {}, expected values in [{}, {}]".format(name, low, high))
+  return values
+
+def _rank_arrays():
+  """
+  Returns RANK_CLASSES, CLASS_STRINGS and RANK_PERCENTAGES as NumPy arrays,
+  built on first use.
+  """
+  global _rank_array_cache
+  if _rank_array_cache is None:
+    if np is None:
+      raise ImportError("the vectorized rank lookups require numpy")
+    _rank_array_cache = (np.array(RANK_CLASSES, dtype=np.int8), np.array(CLASS_STRINGS, dtype=object),
+                         np.array(RANK_PERCENTAGES))
+  return _rank_array_cache
+
+
 class Evaluator(object):
     """
     Evaluates hand strengths using a variant of Cactus Kev's algorithm:
@@ -524,7 +805,7 @@ class Evaluator(object):
 
     def __init__(self):
 
-        self.table = LookupTable()
+        self.table = get_lookup_table()
         
         self.hand_size_map = {
             5: self._five,
@@ -541,6 +822,53 @@ class Evaluator(object):
         all_cards = cards + board
         return self.hand_size_map[len(all_cards)](all_cards)
 
+    def prefix_state(self, cards, state=None):
+        """
+        Precomputes whatever evaluate_prefix can reuse about some board
+        cards, continuing from the state of earlier board cards if given.
+        The 5-card subset search has nothing to reuse, so returns None.
+        """
+        return None
+
+    def evaluate_prefix(self, state, board, cards):
+        """
+        Ranks cards on a board whose prefix_state has already been computed.
+        """
+        return self.evaluate(cards, board)
+
+    def evaluate_batch(self, boards, hands):
+        """
+        Vectorized evaluate over N hands. Takes an (N, 3-5) board array and
+        an (N, 2) hole card array, either as Card.new ints or as 0-51 deck
+        indices (rank * 4 + suit in Deck order), and returns an (N,) array
+        of ranks identical to calling evaluate on each row. Requires NumPy.
+        """
+        if np is None:
+            raise ImportError("evaluate_batch requires numpy")
+
+        cards = np.concatenate([np.asarray(hands, dtype=np.int64),
+                                np.asarray(boards, dtype=np.int64)], axis=1)
+        if cards.size and cards.max() < 52:
+            cards = np.array(CARD_INTS, dtype=np.int64)[cards]
+
+        flush_ranks, prime_keys, prime_ranks = self.table.batch_arrays()
+        cards = cards.astype(np.int32).T  # 5 primes multiply to < 2^31
+        suits = [(c >> 12) & 0xF for c in cards]
+        bitranks = [(c >> 16) & 0x1FFF for c in cards]
+        primes = [c & 0xFF for c in cards]
+
+        best = np.full(cards.shape[1], LookupTable.MAX_HIGH_CARD, dtype=np.int32)
+        for a, b, c, d, e in itertools.combinations(range(cards.shape[0]), 5):
+            product = primes[a] * primes[b] * primes[c] * primes[d] * primes[e]
+            ranks = prime_ranks[np.searchsorted(prime_keys, product)]
+            flush = (suits[a] & suits[b] & suits[c] & suits[d] & suits[e]) != 0
+            if flush.any():
+                mask = bitranks[a] | bitranks[b] | bitranks[c] | bitranks[d] | bitranks[e]
+                ranks = np.where(flush, flush_ranks[mask], ranks)
+            np.minimum(best, ranks, out=best)
+
+        return best
+
     def _five(self, cards):
         """
         Performs an evalution given cards in integer form, mapping them to
@@ -598,24 +926,8 @@ class Evaluator(object):
         Returns the class of hand given the hand hand_rank
         returned from evaluate. 
         """
-        if hr >= 0 and hr <= LookupTable.MAX_STRAIGHT_FLUSH:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_STRAIGHT_FLUSH]
-        elif hr <= LookupTable.MAX_FOUR_OF_A_KIND:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_FOUR_OF_A_KIND]
-        elif hr <= LookupTable.MAX_FULL_HOUSE:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_FULL_HOUSE]
-        elif hr <= LookupTable.MAX_FLUSH:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_FLUSH]
-        elif hr <= LookupTable.MAX_STRAIGHT:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_STRAIGHT]
-        elif hr <= LookupTable.MAX_THREE_OF_A_KIND:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_THREE_OF_A_KIND]
-        elif hr <= LookupTable.MAX_TWO_PAIR:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_TWO_PAIR]
-        elif hr <= LookupTable.MAX_PAIR:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_PAIR]
-        elif hr <= LookupTable.MAX_HIGH_CARD:
-            return LookupTable.MAX_TO_RANK_CLASS[LookupTable.MAX_HIGH_CARD]
+        if 0 <= hr <= LookupTable.MAX_HIGH_CARD:
+            return RANK_CLASSES[hr]
         else:
             raise Exception("Inavlid hand rank, cannot return rank class")
 
@@ -631,6 +943,24 @@ class Evaluator(object):
         """
         return float(hand_rank) / float(LookupTable.MAX_HIGH_CARD)
 
+    def get_rank_classes(self, hand_ranks):
+        """
+        get_rank_class over a NumPy array of hand ranks.
+        """
+        return _rank_arrays()[0][_checked_array(hand_ranks, 1, LookupTable.MAX_HIGH_CARD, "hand rank")]
+
+    def classes_to_strings(self, class_ints):
+        """
+        class_to_string over a NumPy array of classes.
+        """
+        return _rank_arrays()[1][_checked_array(class_ints, 1, len(CLASS_STRINGS) - 1, "rank class")]
+
+    def get_five_card_rank_percentages(self, hand_ranks):
+        """
+        get_five_card_rank_percentage over a NumPy array of hand ranks.
+        """
+        return _rank_arrays()[2][_checked_array(hand_ranks, 1, LookupTable.MAX_HIGH_CARD, "hand rank")]
+
     def hand_summary(self, board, hands):
         """
         Gives a sumamry of the hand with ranks as time proceeds. 
@@ -683,4 +1013,1625 @@ class Evaluator(object):
                 if len(winners) == 1:
                     print("Player {} is the winner with a {}\n".format(winners[0] + 1, hand_result))
                 else:
-                    print("Players {} tied for the win with a {}\n".format([x + 1 for x in winners],hand_result))
\ No newline at end of file
+                    print("Players {} tied for the win with a {}\n".format([x + 1 for x in winners],hand_result))
+
+
+class SevenCardEvaluator(Evaluator):
+    """
+    Evaluator backed by a precomputed 7-card table, opened with mmap so
+    every process on the machine shares the same pages.
+
+    The table is a state machine over card ranks: each state is a multiset
+    of the ranks seen so far, and feeding the seventh rank yields the
+    unsuited hand rank directly. Flushes are found from per-suit counts
+    and looked up by their 13 bit rank mask. A hand can't hold both a
+    flush and a full house or quads with only 7 cards, so the flush rank,
+    when there is one, is always the answer.
+
+    File layout (little endian int32s after a 16 byte header):
+        header:  magic 'HEV7', version, len(ranks), len(flushes)
+        ranks:   state machine, states are premultiplied by 13
+        flushes: best flush rank for each 13 bit rank mask
+    """
+    MAGIC = b'HEV7'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIII')
+
+    # suit bit => key whose sum counts each suit in its own octal digit
+    SUIT_KEYS = [0, 1, 8, 0, 64, 0, 0, 0, 512]
+
+    def __init__(self, filepath):
+        Evaluator.__init__(self)
+
+        self._file = open(filepath, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_ranks, num_flushes = SevenCardEvaluator.HEADER.unpack_from(self._mmap)
+        if magic != SevenCardEvaluator.MAGIC or version != SevenCardEvaluator.VERSION:
+            raise ValueError("Not a version {} seven card table: {}".format(SevenCardEvaluator.VERSION, filepath))
+
+        view = memoryview(self._mmap)
+        offset = SevenCardEvaluator.HEADER.size
+        self.rank_states = view[offset:offset + 4 * num_ranks].cast('i')
+        offset += 4 * num_ranks
+        self.flush_ranks = view[offset:offset + 4 * num_flushes].cast('i')
+
+        # suit key sum => suit bit of the flush suit, or 0
+        self.flush_suits = [0] * (7 * 512 + 1)
+        for counts in itertools.product(range(8), repeat=4):
+            if sum(counts) == 7:
+                key = counts[0] + 8 * counts[1] + 64 * counts[2] + 512 * counts[3]
+                for suit_index, count in enumerate(counts):
+                    if count >= 5:
+                        self.flush_suits[key] = 1 << suit_index
+
+        self.hand_size_map[7] = self._seven
+
+    def prefix_state(self, cards, state=None):
+        rank_state, suits = state or (0, 0)
+        states = self.rank_states
+        keys = SevenCardEvaluator.SUIT_KEYS
+        for c in cards:
+            rank_state = states[rank_state + ((c >> 8) & 0xF)]
+            suits += keys[(c >> 12) & 0xF]
+        return rank_state, suits
+
+    def evaluate_prefix(self, state, board, cards):
+        if len(board) + len(cards) != 7:
+            return Evaluator.evaluate_prefix(self, state, board, cards)
+
+        rank_state, suits = state
+        states = self.rank_states
+        keys = SevenCardEvaluator.SUIT_KEYS
+        for c in cards:
+            rank_state = states[rank_state + ((c >> 8) & 0xF)]
+            suits += keys[(c >> 12) & 0xF]
+
+        flush_suit = self.flush_suits[suits]
+        if flush_suit:
+            return self._flush_rank(board + cards, flush_suit)
+        return rank_state
+
+    def _flush_rank(self, cards, flush_suit):
+        mask = 0
+        for c in cards:
+            if (c >> 12) & flush_suit:
+                mask |= c >> 16
+        return self.flush_ranks[mask]
+
+    def _seven(self, cards):
+        """
+        Ranks 7 cards with one state transition per card and, for flushes,
+        a single mask lookup.
+        """
+        states = self.rank_states
+        keys = SevenCardEvaluator.SUIT_KEYS
+        state = 0
+        suits = 0
+        for c in cards:
+            state = states[state + ((c >> 8) & 0xF)]
+            suits += keys[(c >> 12) & 0xF]
+
+        flush_suit = self.flush_suits[suits]
+        if flush_suit:
+            return self._flush_rank(cards, flush_suit)
+
+        return state
+
+    @staticmethod
+    def generate(filepath):
+        """
+        Builds the 7-card table from the 5-card lookup tables and writes it
+        to filepath. Takes a few seconds; only needs doing once.
+        """
+        table = get_lookup_table()
+        primes = Card.PRIMES
+
+        def unsuited_rank(counts):
+            ranks = []
+            for r, count in enumerate(counts):
+                ranks += [r] * count
+            best = LookupTable.MAX_HIGH_CARD
+            for combo in set(itertools.combinations(ranks, 5)):
+                product = 1
+                for r in combo:
+                    product *= primes[r]
+                score = table.unsuited_lookup[product]
+                if score < best:
+                    best = score
+            return best
+
+        # number the rank multisets of 0-6 cards breadth first
+        ids = {(0,) * 13: 0}
+        frontier = [(0,) * 13]
+        for size in range(6):
+            next_frontier = []
+            for counts in frontier:
+                for r in range(13):
+                    if counts[r] < 4:
+                        child = counts[:r] + (counts[r] + 1,) + counts[r + 1:]
+                        if child not in ids:
+                            ids[child] = len(ids)
+                            next_frontier.append(child)
+            frontier = next_frontier
+
+        ranks = array('i', [0] * (13 * len(ids)))
+        for counts, state in ids.items():
+            size = sum(counts)
+            for r in range(13):
+                if counts[r] == 4:
+                    continue
+                child = counts[:r] + (counts[r] + 1,) + counts[r + 1:]
+                if size == 6:
+                    ranks[13 * state + r] = unsuited_rank(child)
+                else:
+                    ranks[13 * state + r] = 13 * ids[child]
+
+        flushes = array('i', [0] * (1 << 13))
+        for mask in range(1 << 13):
+            bits = [1 << r for r in range(13) if mask & (1 << r)]
+            if not 5 <= len(bits) <= 7:
+                continue
+            flushes[mask] = min(table.flush_lookup[Card.prime_product_from_rankbits(sum(combo))]
+                                for combo in itertools.combinations(bits, 5))
+
+        if sys.byteorder != 'little':
+            ranks.byteswap()
+            flushes.byteswap()
+        with open(filepath, 'wb') as f:
+            f.write(SevenCardEvaluator.HEADER.pack(SevenCardEvaluator.MAGIC, SevenCardEvaluator.VERSION,
+                                                   len(ranks), len(flushes)))
+            ranks.tofile(f)
+            flushes.tofile(f)
+
+
+class DirectEvaluator(Evaluator):
+    """
+    Evaluates 6 and 7 card hands directly instead of trying every 5 card
+    subset. Flushes come from per-suit rank masks, straights from sliding
+    the OR of the rank bits, and pairs, trips and quads from a histogram
+    of rank counts. The best five cards found this way are looked up in
+    the usual 5-card tables, so ranks are identical to Evaluator and no
+    tables beyond those are needed.
+    """
+
+    # suit bit => one in that suit's nibble
+    SUIT_NIBBLES = [0, 1, 0x10, 0, 0x100, 0, 0, 0, 0x1000]
+    EMPTY_SUMMARY = (0, 0, 0, 0, 0)
+
+    def __init__(self):
+        Evaluator.__init__(self)
+
+        self.hand_size_map[6] = self._direct
+        self.hand_size_map[7] = self._direct
+
+    @staticmethod
+    def straight_bits(rankbits):
+        """
+        Returns the rank bits of the highest straight in rankbits, or 0.
+        """
+        runs = rankbits & (rankbits << 1) & (rankbits << 2) & (rankbits << 3) & (rankbits << 4)
+        if runs:
+            return 0x1F << (runs.bit_length() - 5)
+        if rankbits & 0x100F == 0x100F:  # wheel, A-2-3-4-5
+            return 0x100F
+        return 0
+
+    @staticmethod
+    def prime_product(rankbits):
+        """
+        Card.prime_product_from_rankbits, visiting only the set bits.
+        """
+        product = 1
+        while rankbits:
+            low = rankbits & -rankbits
+            product *= Card.PRIMES[low.bit_length() - 1]
+            rankbits ^= low
+        return product
+
+    @staticmethod
+    def top_bits(rankbits, n):
+        """
+        Returns the n highest set bits of rankbits.
+        """
+        while bin(rankbits).count('1') > n:
+            rankbits &= rankbits - 1  # clear the lowest set bit
+        return rankbits
+
+    def _direct(self, cards):
+        """
+        Ranks 5 to 7 cards in integer form in the range [1, 7462].
+        """
+        return self._rank_summary(cards, DirectEvaluator.summarize(cards))
+
+    def prefix_state(self, cards, state=None):
+        return DirectEvaluator.summarize(cards, state or DirectEvaluator.EMPTY_SUMMARY)
+
+    def evaluate_prefix(self, state, board, cards):
+        all_cards = board + cards
+        if len(all_cards) < 5:
+            return Evaluator.evaluate_prefix(self, state, board, cards)
+        return self._rank_summary(all_cards, DirectEvaluator.summarize(cards, state))
+
+    @staticmethod
+    def summarize(cards, summary=EMPTY_SUMMARY):
+        """
+        Adds cards to a (suit counts, seen1, seen2, seen3, seen4) summary.
+        Each suit counts in its own nibble, and seenN has a rank's bit set
+        once that rank has been seen N times, making up a rank histogram.
+        """
+        suit_counts, seen1, seen2, seen3, seen4 = summary
+        for c in cards:
+            suit_counts += DirectEvaluator.SUIT_NIBBLES[(c >> 12) & 0xF]
+            bit = c >> 16
+            if seen1 & bit:
+                if seen2 & bit:
+                    if seen3 & bit:
+                        seen4 |= bit
+                    else:
+                        seen3 |= bit
+                else:
+                    seen2 |= bit
+            else:
+                seen1 |= bit
+
+        return suit_counts, seen1, seen2, seen3, seen4
+
+    def _rank_summary(self, cards, summary):
+        """
+        Ranks cards given their summary. The cards themselves are only
+        needed to find the flush suit's rank mask.
+        """
+        suit_counts, seen1, seen2, seen3, seen4 = summary
+
+        # a nibble of 5 or more overflows into its top bit when 3 is added
+        flush_nibble = (suit_counts + 0x3333) & 0x8888
+        if flush_nibble:
+            flush_suit = 1 << ((flush_nibble.bit_length() - 4) // 4)
+            mask = 0
+            for c in cards:
+                if (c >> 12) & flush_suit:
+                    mask |= c >> 16
+            best = DirectEvaluator.straight_bits(mask)
+            if not best:
+                best = DirectEvaluator.top_bits(mask, 5)
+            return self.table.flush_lookup[DirectEvaluator.prime_product(best)]
+
+        lookup = self.table.unsuited_lookup
+        primes = Card.PRIMES
+        if seen4:
+            quad = seen4.bit_length() - 1
+            kicker = (seen1 & ~seen4).bit_length() - 1
+            return lookup[primes[quad] ** 4 * primes[kicker]]
+
+        if seen3:
+            trip = seen3.bit_length() - 1
+            pair = (seen2 & ~(1 << trip)).bit_length() - 1
+            if pair >= 0:
+                return lookup[primes[trip] ** 3 * primes[pair] ** 2]
+
+        straight = DirectEvaluator.straight_bits(seen1)
+        if straight:
+            return lookup[DirectEvaluator.prime_product(straight)]
+
+        if seen3:
+            kickers = DirectEvaluator.top_bits(seen1 & ~seen3, 2)
+            return lookup[primes[trip] ** 3 * DirectEvaluator.prime_product(kickers)]
+
+        if seen2:
+            pairs = DirectEvaluator.top_bits(seen2, 2)
+            product = DirectEvaluator.prime_product(pairs) ** 2
+            kickers = DirectEvaluator.top_bits(seen1 & ~pairs, 5 - 2 * bin(pairs).count('1'))
+            return lookup[product * DirectEvaluator.prime_product(kickers)]
+
+        return lookup[DirectEvaluator.prime_product(DirectEvaluator.top_bits(seen1, 5))]
+
+
+class BoardContext(object):
+    """
+    A board whose analysis is done once and reused for every hand ranked
+    on it. Built from a flop, turn or river (strings or ints), and a flop
+    context can be extended card by card to the turn and river without
+    redoing the earlier cards:
+
+        flop = BoardContext(['Ah', 'Kd', '7c'])
+        river = flop.extend(['2s']).extend(['9h'])
+        ranks = river.evaluate_hands([['Qh', 'Jh'], ['7d', '7s']])
+    """
+
+    def __init__(self, board, evaluator=None):
+        self.evaluator = evaluator if evaluator is not None else get_evaluator()
+        self.cards = to_card_ints(board)
+        self.state = self.evaluator.prefix_state(self.cards)
+
+    def extend(self, cards):
+        """
+        Returns a new context with cards added to this board.
+        """
+        cards = to_card_ints(cards)
+        context = BoardContext.__new__(BoardContext)
+        context.evaluator = self.evaluator
+        context.cards = self.cards + cards
+        context.state = self.evaluator.prefix_state(cards, self.state)
+        return context
+
+    def evaluate(self, hand):
+        """
+        Ranks hole cards (strings or ints) on this board.
+        """
+        return self.evaluator.evaluate_prefix(self.state, self.cards, to_card_ints(hand))
+
+    def evaluate_hands(self, hands):
+        """
+        Ranks each of a list of hole card pairs on this board.
+        """
+        evaluate_prefix = self.evaluator.evaluate_prefix
+        state = self.state
+        board = self.cards
+        return [evaluate_prefix(state, board, to_card_ints(hand)) for hand in hands]
+
+
+RIVER_CACHE_SIZE = 256
+
+def river_ranking(board):
+  """
+  Returns the RiverRanking of a 5-card board (strings or ints). Rankings
+  are cached in an LRU under the board's suit canonical form, so boards
+  that only differ by relabelling suits share one ranking, remapped onto
+  the board's own suits, and repeated queries are nearly free.
+  """
+  board = to_card_ints(board)
+  indices = [CARD_INT_TO_INDEX[c] for c in board]
+  canonical, suits = min((tuple(sorted(c - c % 4 + suits[c % 4] for c in indices)), suits)
+                         for suits in itertools.permutations(range(4)))
+  ranking = _river_ranking(canonical)
+  if canonical == tuple(sorted(indices)):
+    return ranking
+  inverse = [suits.index(suit) for suit in range(4)]
+  return ranking._relabeled(inverse, board)
+
+@functools.lru_cache(maxsize=RIVER_CACHE_SIZE)
+def _river_ranking(board):
+  return RiverRanking([CARD_INTS[c] for c in board])
+
+
+class RiverRanking(object):
+    """
+    Every hole card combo that doesn't conflict with a river board, sorted
+    from best to worst and grouped into ties. Equity against a range is
+    then a pair of bisections into prefix sums of the range's weights,
+    corrected for the few combos that share a card with the hand.
+
+    Attributes:
+        combos: combo indices, best hand first
+        ranks: hand rank of each entry of combos (ascending)
+        group_starts: index into combos where each tie group starts, with
+            len(combos) appended
+    """
+
+    def __init__(self, board):
+        assert len(board) == 5, "Invalid board length"
+        board = to_card_ints(board)
+        dead = set(CARD_INT_TO_INDEX[c] for c in board)
+        live = [k for k, (i, j) in enumerate(COMBOS) if i not in dead and j not in dead]
+
+        context = BoardContext(board)
+        scored = sorted(zip(context.evaluate_hands([[CARD_INTS[i], CARD_INTS[j]] for i, j in (COMBOS[k] for k in live)]), live))
+        self.board = board
+        self.ranks = [rank for rank, _ in scored]
+        self.combos = [k for _, k in scored]
+        self.group_starts = [p for p in range(len(scored)) if p == 0 or self.ranks[p] != self.ranks[p - 1]]
+        self.group_starts.append(len(scored))
+        self._index_positions()
+        self._uniform_prefix = self.prefix_sums(None)
+
+    def _index_positions(self):
+        self.positions = {k: p for p, k in enumerate(self.combos)}
+        # deck index => positions of the combos holding that card
+        self.card_positions = [[] for _ in range(52)]
+        for p, k in enumerate(self.combos):
+            i, j = COMBOS[k]
+            self.card_positions[i].append(p)
+            self.card_positions[j].append(p)
+
+    def _relabeled(self, suits, board):
+        """
+        Returns the ranking of board, the image of this ranking's board when
+        every card's suit s becomes suits[s]. Relabelling suits keeps every
+        hand rank, so only the combos move.
+        """
+        card_map = [c - c % 4 + suits[c % 4] for c in range(52)]
+        ranking = RiverRanking.__new__(RiverRanking)
+        ranking.board = board
+        ranking.ranks = self.ranks
+        ranking.group_starts = self.group_starts
+        ranking.combos = [COMBO_TO_INDEX[tuple(sorted((card_map[i], card_map[j])))] for i, j in
+                          (COMBOS[k] for k in self.combos)]
+        ranking._index_positions()
+        ranking._uniform_prefix = self._uniform_prefix
+        return ranking
+
+    def prefix_sums(self, weights):
+        """
+        Prefix sums of range weights in ranking order, for reuse across many
+        equity calls against the same range. weights is a sequence of 1326
+        weights indexed by combo index, or None for a uniform range.
+        """
+        prefix = [0.0]
+        total = 0.0
+        for k in self.combos:
+            total += 1.0 if weights is None else weights[k]
+            prefix.append(total)
+        return prefix
+
+    def rank_of(self, hand):
+        """
+        Returns the hand rank of hole cards on this board.
+        """
+        return self.ranks[self.positions[combo_index(hand)]]
+
+    def equity(self, hand, weights=None, prefix=None):
+        """
+        Returns the showdown equity of hole cards against a range, given as
+        1326 weights by combo index (uniform if None) or as prefix_sums.
+        """
+        position = self.positions[combo_index(hand)]
+        if prefix is None:
+            prefix = self._uniform_prefix if weights is None else self.prefix_sums(weights)
+        return self._equity_at(position, prefix)
+
+    def equities(self, weights=None):
+        """
+        Returns a dict of combo index => showdown equity against the range
+        for every combo that can be held on this board.
+        """
+        prefix = self._uniform_prefix if weights is None else self.prefix_sums(weights)
+        return {k: self._equity_at(p, prefix) for p, k in enumerate(self.combos)}
+
+    def _equity_at(self, position, prefix):
+        ranks = self.ranks
+        rank = ranks[position]
+        better = bisect.bisect_left(ranks, rank)
+        not_worse = bisect.bisect_right(ranks, rank)
+        win = prefix[-1] - prefix[not_worse]
+        tie = prefix[not_worse] - prefix[better]
+        lose = prefix[better]
+
+        # take out opponent combos that share a card with this hand, the hand
+        # itself included (it holds both cards, so appears twice)
+        i, j = COMBOS[self.combos[position]]
+        for p in self.card_positions[i] + self.card_positions[j]:
+            weight = prefix[p + 1] - prefix[p]
+            if p == position:
+                weight /= 2
+            if ranks[p] > rank:
+                win -= weight
+            elif ranks[p] == rank:
+                tie -= weight
+            else:
+                lose -= weight
+
+        total = win + tie + lose
+        if total <= 0:
+            raise ValueError("Range is empty once blocked combos are removed")
+        return (win + tie / 2) / total
+
+
+EquityResult = namedtuple('EquityResult', ['equity', 'std_error', 'iterations'])
+
+# samples per independently seeded chunk of Monte Carlo work
+EQUITY_CHUNK = 1000
+
+def range_weights(opponent_range):
+  """
+  Converts an opponent range to 1326 weights by combo index. Ranges are
+  None (any two cards), a list of hole card pairs, or already weights.
+  """
+  if opponent_range is None:
+    return [1.0] * len(COMBOS)
+  opponent_range = list(opponent_range)
+  if len(opponent_range) == len(COMBOS) and not isinstance(opponent_range[0], (list, tuple)):
+    return [float(w) for w in opponent_range]
+  weights = [0.0] * len(COMBOS)
+  for hand in opponent_range:
+    weights[combo_index(hand)] = 1.0
+  return weights
+
+def equity(hand, board, opponent_range=None, iterations=100000, workers=1, seed=0, tolerance=None):
+  """
+  Monte Carlo showdown equity of hole cards on a 0-5 card board against an
+  opponent range (see range_weights), returned as an EquityResult.
+
+  Samples are drawn in chunks of EQUITY_CHUNK, each with its own RNG seeded
+  from (seed, chunk number), and always combined in chunk order, so the
+  result for a given seed is the same however many worker processes share
+  the chunks. With a tolerance, sampling stops after the first chunk at
+  which the standard error has dropped below it.
+  """
+  if iterations < 1:
+    raise ValueError("Equity needs at least one iteration")
+  hand = [CARD_INT_TO_INDEX[c] for c in to_card_ints(hand)]
+  board = [CARD_INT_TO_INDEX[c] for c in to_card_ints(board)]
+  weights = range_weights(opponent_range)
+  num_chunks = -(-iterations // EQUITY_CHUNK)
+  args = [(hand, board, weights, min(EQUITY_CHUNK, iterations - chunk * EQUITY_CHUNK), seed, chunk)
+          for chunk in range(num_chunks)]
+
+  n = 0
+  total = 0.0
+  total_sq = 0.0
+  for chunk_n, chunk_total, chunk_total_sq in _map_in_order(_equity_chunk, args, workers):
+    n += chunk_n
+    total += chunk_total
+    total_sq += chunk_total_sq
+    mean = total / n
+    std_error = math.sqrt(max(total_sq / n - mean * mean, 0.0) / n)
+    if tolerance is not None and n > 1 and std_error < tolerance:
+      break
+
+  return EquityResult(mean, std_error, n)
+
+def _map_in_order(function, args, workers):
+  """
+  Yields function(*a) for each a in args, in order, spreading the calls
+  over a process pool when workers > 1. Stops submitting work when the
+  caller stops iterating.
+  """
+  if workers <= 1:
+    for a in args:
+      yield function(*a)
+    return
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    pending = []
+    queued = iter(args)
+    try:
+      for a in itertools.islice(queued, 2 * workers):
+        pending.append(pool.submit(function, *a))
+      while pending:
+        result = pending.pop(0).result()
+        for a in itertools.islice(queued, 1):
+          pending.append(pool.submit(function, *a))
+        yield result
+    finally:
+      for future in pending:
+        future.cancel()
+
+def _equity_chunk(hand, board, weights, samples, seed, chunk):
+  """
+  Plays out one chunk of equity samples, returning (samples, sum, sum of
+  squares) of the per-sample results.
+  """
+  rng = random.Random('{}:{}'.format(seed, chunk))
+  evaluate = get_evaluator().evaluate
+  dead = set(hand + board)
+  live = [k for k, (i, j) in enumerate(COMBOS) if weights[k] > 0 and i not in dead and j not in dead]
+  if not live:
+    raise ValueError("Range is empty once blocked combos are removed")
+  cum_weights = list(itertools.accumulate(weights[k] for k in live))
+  hand_cards = [CARD_INTS[i] for i in hand]
+  board_cards = [CARD_INTS[i] for i in board]
+  deck = [i for i in range(52) if i not in dead]
+
+  total = 0.0
+  total_sq = 0.0
+  for opponent in rng.choices(live, cum_weights=cum_weights, k=samples):
+    i, j = COMBOS[opponent]
+    runout = rng.sample([c for c in deck if c != i and c != j], 5 - len(board))
+    full_board = board_cards + [CARD_INTS[c] for c in runout]
+    ours = evaluate(hand_cards, full_board)
+    theirs = evaluate([CARD_INTS[i], CARD_INTS[j]], full_board)
+    result = 1.0 if ours < theirs else 0.5 if ours == theirs else 0.0
+    total += result
+    total_sq += result * result
+
+  return samples, total, total_sq
+
+
+def exact_equity(hand, board, opponent_range=None, time_limit=None):
+  """
+  Exact showdown equity of hole cards on a flop, turn or river against an
+  opponent range (see range_weights; a single hand for hand vs hand), by
+  enumerating every runout. Returns an EquityResult whose iterations is
+  the number of runouts counted.
+
+  Runouts that are the same up to swapping suits the hand, board and range
+  can't tell apart are evaluated once and weighted by how many there are.
+  With NumPy, every live opponent combo on a chunk of runouts is ranked in
+  one evaluate_batch call; without it each turn's board context is reused
+  for all of its rivers. Given a time_limit in seconds, enumeration stops
+  early when it runs out; runouts are visited in a fixed shuffled order so
+  the partial answer is still a fair estimate, and std_error is then
+  estimated from the runouts seen.
+  """
+  hand_cards = to_card_ints(hand)
+  board_cards = to_card_ints(board)
+  if not 3 <= len(board_cards) <= 5:
+    raise ValueError("Exact equity needs a flop, turn or river")
+  hand_index = [CARD_INT_TO_INDEX[c] for c in hand_cards]
+  board_index = [CARD_INT_TO_INDEX[c] for c in board_cards]
+  known = set(hand_index + board_index)
+  weights = range_weights(opponent_range)
+  live = [k for k, (i, j) in enumerate(COMBOS) if weights[k] > 0 and i not in known and j not in known]
+  deck = [c for c in range(52) if c not in known]
+
+  # count each runout under its suit isomorphic representative
+  symmetries = suit_symmetries(hand_index, board_index, weights=weights)
+  runouts = {}
+  for runout in itertools.combinations(deck, 5 - len(board_cards)):
+    canonical = min(tuple(sorted(perm[c] for c in runout)) for perm in symmetries)
+    runouts[canonical] = runouts.get(canonical, 0) + 1
+  order = sorted(runouts)
+  random.Random(0).shuffle(order)
+
+  start = time.perf_counter()
+  if np is not None:
+    results = _batch_runout_equities(hand_index, board_index, order, weights, live)
+  else:
+    results = _runout_equities(hand_cards, board_cards, order, weights, live)
+  count = 0
+  total = 0.0
+  total_sq = 0.0
+  finished = True
+  for runout, result in results:
+    if time_limit is not None and count and time.perf_counter() - start > time_limit:
+      finished = False
+      break
+    if result is None:
+      continue
+
+    multiplicity = runouts[runout]
+    count += multiplicity
+    total += multiplicity * result
+    total_sq += multiplicity * result * result
+
+  if count == 0:
+    raise ValueError("Range is empty once blocked combos are removed")
+  mean = total / count
+  std_error = 0.0
+  if not finished:
+    std_error = math.sqrt(max(total_sq / count - mean * mean, 0.0) / count)
+  return EquityResult(mean, std_error, count)
+
+# runouts ranked per evaluate_batch call in exact_equity
+EXACT_CHUNK = 64
+
+def _batch_runout_equities(hand_index, board_index, runouts, weights, live):
+  """
+  Generates (runout, equity) for runouts of deck indices, with equity None
+  when the range is empty on that runout, ranking the live combos of
+  EXACT_CHUNK runouts at a time with evaluate_batch.
+  """
+  evaluator = get_evaluator()
+  pairs = np.array([COMBOS[k] for k in live], dtype=np.int64).reshape(-1, 2)
+  live_weights = np.array([weights[k] for k in live], dtype=np.float64)
+  for start in range(0, len(runouts), EXACT_CHUNK):
+    chunk = runouts[start:start + EXACT_CHUNK]
+    cards = np.array(chunk, dtype=np.int64).reshape(len(chunk), 5 - len(board_index))
+    boards = np.concatenate([np.tile(np.array(board_index, dtype=np.int64), (len(chunk), 1)), cards], axis=1)
+    blocked = (pairs[None, :, :, None] == cards[:, None, None, :]).any(axis=(2, 3))
+    rows, cols = np.nonzero(~blocked)
+    ours = evaluator.evaluate_batch(boards, np.tile(np.array(hand_index, dtype=np.int64), (len(chunk), 1)))[rows]
+    theirs = evaluator.evaluate_batch(boards[rows], pairs[cols])
+    points = np.where(ours < theirs, 1.0, np.where(ours == theirs, 0.5, 0.0)) * live_weights[cols]
+    win = np.bincount(rows, points, minlength=len(chunk))
+    weight = np.bincount(rows, live_weights[cols], minlength=len(chunk))
+    for runout, w, total in zip(chunk, win, weight):
+      yield runout, (float(w / total) if total > 0 else None)
+
+def _runout_equities(hand_cards, board_cards, runouts, weights, live):
+  """
+  Generates (runout, equity) as _batch_runout_equities does without NumPy,
+  evaluating the combos one at a time and reusing each turn's context.
+  """
+  base = BoardContext(board_cards)
+  turns = {}
+  for runout in runouts:
+    if len(runout) == 2:
+      if runout[0] not in turns:
+        turns[runout[0]] = base.extend([CARD_INTS[runout[0]]])
+      context = turns[runout[0]].extend([CARD_INTS[runout[1]]])
+    else:
+      context = base.extend([CARD_INTS[c] for c in runout])
+
+    ours = context.evaluate(hand_cards)
+    win = 0.0
+    weight = 0.0
+    for k in live:
+      i, j = COMBOS[k]
+      if i in runout or j in runout:
+        continue
+      theirs = context.evaluate([CARD_INTS[i], CARD_INTS[j]])
+      win += weights[k] if ours < theirs else weights[k] / 2 if ours == theirs else 0.0
+      weight += weights[k]
+    yield runout, (win / weight if weight > 0 else None)
+
+def suit_symmetries(*groups, weights=None):
+  """
+  Returns the suit permutations, as deck index => deck index lists, that
+  map each group of known cards (deck indices) onto itself and leave the
+  combo weights unchanged. Suits holding the same ranks within every group,
+  e.g. suits with no known cards at all, can be swapped; keeping the groups
+  apart stops a hole card being swapped onto a board card's suit.
+  """
+  suit_ranks = [tuple(frozenset(c // 4 for c in group if c % 4 == suit) for group in groups) for suit in range(4)]
+  symmetries = []
+  for suits in itertools.permutations(range(4)):
+    if any(suit_ranks[suits[suit]] != suit_ranks[suit] for suit in range(4)):
+      continue
+    perm = [c - c % 4 + suits[c % 4] for c in range(52)]
+    if weights is not None and any(
+        weights[COMBO_TO_INDEX[tuple(sorted((perm[i], perm[j])))]] != weights[k]
+        for k, (i, j) in enumerate(COMBOS)):
+      continue
+    symmetries.append(perm)
+  return symmetries
+
+
+def preflop_class(hand):
+  """
+  Returns the starting hand class of hole cards as an index into the usual
+  13x13 grid, with ranks counted down from aces: pairs on the diagonal,
+  suited hands above it and offsuit hands below. See CLASS_NAMES.
+  """
+  (hi, hi_suit), (lo, lo_suit) = sorted(((Card.get_rank_int(c), Card.get_suit_int(c)) for c in to_card_ints(hand)),
+                                        reverse=True)
+  row, col = 12 - hi, 12 - lo
+  if hi_suit == lo_suit:
+    return row * 13 + col
+  return col * 13 + row
+
+CLASS_NAMES = [''] * 169
+for _row, _col in itertools.product(range(13), repeat=2):
+  _hi, _lo = Card.STR_RANKS[12 - min(_row, _col)], Card.STR_RANKS[12 - max(_row, _col)]
+  CLASS_NAMES[_row * 13 + _col] = _hi + _lo + ('' if _row == _col else 's' if _row < _col else 'o')
+
+# preflop class of each combo index
+COMBO_CLASSES = [preflop_class([CARD_INTS[i], CARD_INTS[j]]) for i, j in COMBOS]
+
+
+class PreflopEquity(object):
+    """
+    All-in preflop equity of every combo against every other combo, and of
+    every starting hand class against every other, loaded with mmap from
+    the file written by `python3 handeval.py preflop-table`.
+
+    The combo matrix is exact: every board is enumerated, once per suit
+    isomorphism class, weighted by how many boards it stands for. Entries
+    for combos sharing a card are NaN. A class entry is the mean over all
+    non-conflicting combo pairs of the two classes.
+
+    File layout (little endian, after a 16 byte header):
+        header:  magic 'HEPF', version, number of combos, number of classes
+        combos:  float32 [1326, 1326] equity of row combo against column
+        classes: float32 [169, 169] equity of row class against column
+    """
+    MAGIC = b'HEPF'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIII')
+
+    # how often generate saves its partial results
+    CHECKPOINT_SECONDS = 60.
+
+    def __init__(self, filepath):
+        if np is None:
+            raise ImportError("PreflopEquity requires numpy")
+
+        with open(filepath, 'rb') as f:
+            magic, version, num_combos, num_classes = PreflopEquity.HEADER.unpack(f.read(PreflopEquity.HEADER.size))
+        if magic != PreflopEquity.MAGIC or version != PreflopEquity.VERSION:
+            raise ValueError("Not a version {} preflop table: {}".format(PreflopEquity.VERSION, filepath))
+
+        offset = PreflopEquity.HEADER.size
+        self.combos = np.memmap(filepath, dtype='<f4', mode='r', offset=offset, shape=(num_combos, num_combos))
+        offset += 4 * num_combos * num_combos
+        self.classes = np.memmap(filepath, dtype='<f4', mode='r', offset=offset, shape=(num_classes, num_classes))
+
+    def combo_equity(self, hand, opponent):
+        """
+        Returns the equity of hole cards against the opponent's hole cards.
+        """
+        return float(self.combos[combo_index(hand), combo_index(opponent)])
+
+    def class_equity(self, hand_class, opponent_class):
+        """
+        Returns the equity of one starting hand class against another, each
+        given as a CLASS_NAMES entry ('AKs') or a preflop_class index.
+        """
+        if isinstance(hand_class, str):
+            hand_class = CLASS_NAMES.index(hand_class)
+        if isinstance(opponent_class, str):
+            opponent_class = CLASS_NAMES.index(opponent_class)
+        return float(self.classes[hand_class, opponent_class])
+
+    @staticmethod
+    def generate(filepath, workers=1):
+        """
+        Computes both matrices and writes them to filepath. Boards are split
+        into shards by their first two cards and spread over a process pool.
+        Progress is saved to filepath + '.partial' as shards finish, and a
+        later call with the same filepath carries on from there.
+        """
+        if np is None:
+            raise ImportError("generating the preflop table requires numpy")
+
+        shards = [(i, j) for i, j in COMBOS if j <= 48]
+        partial_path = filepath + '.partial'
+        points = np.zeros((len(COMBOS), len(COMBOS)), dtype=np.int64)
+        done = set()
+        if os.path.exists(partial_path):
+            with np.load(partial_path) as partial:
+                points = partial['points']
+                done = set(map(tuple, partial['done'].tolist()))
+
+        def checkpoint():
+            tmp_path = partial_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, points=points, done=np.array(sorted(done), dtype=np.int64).reshape(-1, 2))
+            os.replace(tmp_path, partial_path)
+
+        todo = [shard for shard in shards if shard not in done]
+        last_checkpoint = time.perf_counter()
+        for shard, shard_points in _map_in_order(_preflop_shard, [(shard,) for shard in todo], workers):
+            points += shard_points
+            done.add(shard)
+            if time.perf_counter() - last_checkpoint > PreflopEquity.CHECKPOINT_SECONDS:
+                checkpoint()
+                last_checkpoint = time.perf_counter()
+                print('{}/{} shards done'.format(len(done), len(shards)))
+        checkpoint()
+
+        # every board was counted once per suit permutation of the canonical
+        # board it maps to, so summing over all permutations and dividing by
+        # their number counts each actual board once
+        total = np.zeros_like(points)
+        for perm in suit_symmetries([]):
+            combo_perm = np.array([COMBO_TO_INDEX[tuple(sorted((perm[i], perm[j])))] for i, j in COMBOS])
+            total += points[np.ix_(combo_perm, combo_perm)]
+        boards = math.comb(48, 5)
+        combos = total / (2.0 * 24 * boards)
+
+        index = np.array(COMBOS)
+        conflicts = ((index[:, None, 0] == index[None, :, 0]) | (index[:, None, 0] == index[None, :, 1]) |
+                     (index[:, None, 1] == index[None, :, 0]) | (index[:, None, 1] == index[None, :, 1]))
+        combos[conflicts] = np.nan
+
+        classes = np.zeros((169, 169))
+        combo_classes = np.array(COMBO_CLASSES)
+        for a in range(169):
+            rows = combos[combo_classes == a]
+            for b in range(169):
+                classes[a, b] = np.nanmean(rows[:, combo_classes == b])
+
+        with open(filepath, 'wb') as f:
+            f.write(PreflopEquity.HEADER.pack(PreflopEquity.MAGIC, PreflopEquity.VERSION, len(COMBOS), 169))
+            f.write(combos.astype('<f4').tobytes())
+            f.write(classes.astype('<f4').tobytes())
+        os.remove(partial_path)
+
+
+def _preflop_shard(shard):
+  """
+  Adds up showdown points (2 for a win, 1 for a tie) of every combo against
+  every other over the canonical boards starting with the shard's two
+  cards, each weighted by the number of boards it stands for.
+  """
+  first, second = shard
+  symmetries = suit_symmetries([])
+  evaluator = get_evaluator()
+  index = np.array(COMBOS)
+  hands = np.array(CARD_INTS)[index]
+  # at most 2 points * 24 boards per canonical board * C(50, 3) boards
+  points = np.zeros((len(COMBOS), len(COMBOS)), dtype=np.int32)
+
+  for rest in itertools.combinations(range(second + 1, 52), 3):
+    board = (first, second) + rest
+    images = set(tuple(sorted(perm[c] for c in board)) for perm in symmetries)
+    if min(images) != board:
+      continue
+
+    live = ~np.isin(index, board).any(axis=1)
+    ranks = np.zeros(len(COMBOS), dtype=np.int16)
+    ranks[live] = evaluator.evaluate_batch(np.tile(np.array([CARD_INTS[c] for c in board]), (live.sum(), 1)), hands[live])
+    scores = (ranks[None, :] > ranks[:, None]).view(np.int8) + (ranks[None, :] >= ranks[:, None]).view(np.int8)
+    scores[~live, :] = 0
+    scores[:, ~live] = 0
+    scores *= len(images)
+    points += scores
+
+  return shard, points
+
+
+# cards dealt in each betting round up to each street, for HandIndexer
+STREET_ROUNDS = {0: [2], 3: [2, 3], 4: [2, 3, 1], 5: [2, 3, 1, 1]}
+_hand_indexers = {}
+
+def hand_indexer(street):
+  """
+  Returns the shared HandIndexer for hole cards plus a board of street
+  cards (0, 3, 4 or 5), building it on first use.
+  """
+  if street not in _hand_indexers:
+    _hand_indexers[street] = HandIndexer(STREET_ROUNDS[street])
+  return _hand_indexers[street]
+
+def canonical_index(hand, board):
+  """
+  Returns the dense suit isomorphic index of hole cards and a board, in
+  [0, hand_indexer(len(board)).size).
+  """
+  return hand_indexer(len(board)).index(hand, board)
+
+def canonical_hand(hand, board):
+  """
+  Returns the (hand, board) that stands for every hand and board that only
+  differ from these by a permutation of the suits, as lists of card ints.
+  """
+  indexer = hand_indexer(len(board))
+  return indexer.unindex(indexer.index(hand, board))
+
+
+class HandIndexer(object):
+    """
+    Maps hole cards and board to a dense index over their suit isomorphism
+    classes, and back, after Waugh's hand isomorphism indexing. There are
+    169 preflop, 1,286,792 flop, 55,190,538 turn and 2,428,287,420 river
+    classes.
+
+    Cards are split into rounds (hole cards, flop, turn, river). Each suit
+    holds a set of ranks per round, and two hands are isomorphic exactly
+    when they hold the same multiset of these per-suit rank sets. So:
+        1) every suit's rank sets get an index within suits of the same
+           shape (number of cards in each round),
+        2) suits of the same shape form a group, whose multiset of suit
+           indices gets a combinations-with-repetition index,
+        3) the group indices are combined in mixed radix and offset by the
+           configuration, the sorted shapes of all four suits.
+    """
+
+    def __init__(self, cards_per_round):
+        self.cards_per_round = list(cards_per_round)
+        self.rounds = len(cards_per_round)
+
+        # every way the rounds' cards can be spread over four suits
+        shapes_by_round = [[]]
+        for cards in self.cards_per_round:
+            shapes_by_round = [split + [spread] for split in shapes_by_round
+                               for spread in itertools.product(range(cards + 1), repeat=4) if sum(spread) == cards]
+        configurations = set()
+        for split in shapes_by_round:
+            shapes = sorted((tuple(spread[suit] for spread in split) for suit in range(4)), reverse=True)
+            if all(sum(shape) <= 13 for shape in shapes):
+                configurations.add(tuple(shapes))
+
+        self.configurations = sorted(configurations, reverse=True)
+        self.offsets = {}
+        self.sizes = {}
+        self.size = 0
+        for configuration in self.configurations:
+            size = 1
+            for shape, count in HandIndexer.groups(configuration):
+                size *= math.comb(HandIndexer.suit_size(shape) + count - 1, count)
+            self.offsets[configuration] = self.size
+            self.sizes[configuration] = size
+            self.size += size
+        self.offset_list = [self.offsets[configuration] for configuration in self.configurations]
+
+    @staticmethod
+    def groups(configuration):
+        """
+        Returns the (shape, number of suits) groups of a configuration.
+        """
+        return [(shape, len(list(suits))) for shape, suits in itertools.groupby(configuration)]
+
+    @staticmethod
+    def suit_size(shape):
+        """
+        Returns the number of ways a suit of this shape can hold its ranks.
+        """
+        size = 1
+        available = 13
+        for cards in shape:
+            size *= math.comb(available, cards)
+            available -= cards
+        return size
+
+    def index(self, hand, board):
+        """
+        Returns the index of hole cards and board (strings or ints).
+        """
+        cards = to_card_ints(hand) + to_card_ints(board)
+        masks = [[0] * self.rounds for _ in range(4)]
+        start = 0
+        for r, count in enumerate(self.cards_per_round):
+            for c in cards[start:start + count]:
+                deck_index = CARD_INT_TO_INDEX[c]
+                masks[deck_index % 4][r] |= 1 << (deck_index // 4)
+            start += count
+        if start != len(cards):
+            raise ValueError("Expected {} cards, got {}".format(start, len(cards)))
+
+        suits = sorted(((tuple(bin(mask).count('1') for mask in suit_masks), HandIndexer.suit_index(suit_masks))
+                        for suit_masks in masks), reverse=True)
+        configuration = tuple(shape for shape, _ in suits)
+
+        index = 0
+        position = 0
+        for shape, count in HandIndexer.groups(configuration):
+            suit_indices = sorted(suit_index for _, suit_index in suits[position:position + count])
+            group_index = sum(math.comb(value + i, i + 1) for i, value in enumerate(suit_indices))
+            index = index * math.comb(HandIndexer.suit_size(shape) + count - 1, count) + group_index
+            position += count
+
+        return self.offsets[configuration] + index
+
+    @staticmethod
+    def suit_index(suit_masks):
+        """
+        Indexes one suit's rank masks per round, each round's ranks as a
+        colex index among the ranks not used by earlier rounds.
+        """
+        index = 0
+        used = 0
+        available = 13
+        for mask in suit_masks:
+            cards = bin(mask).count('1')
+            colex = 0
+            i = 1
+            for rank in range(13):
+                if mask & (1 << rank):
+                    position = bin(((1 << rank) - 1) & ~used).count('1')
+                    colex += math.comb(position, i)
+                    i += 1
+            index = index * math.comb(available, cards) + colex
+            used |= mask
+            available -= cards
+        return index
+
+    def unindex(self, index):
+        """
+        Returns the canonical (hand, board) of an index, as lists of card
+        ints. Suits are handed out in Deck order, clubs first.
+        """
+        if not 0 <= index < self.size:
+            raise ValueError("Index out of range")
+
+        configuration = self.configurations[bisect.bisect_right(self.offset_list, index) - 1]
+        index -= self.offsets[configuration]
+
+        groups = HandIndexer.groups(configuration)
+        group_indices = []
+        for shape, count in reversed(groups):
+            radix = math.comb(HandIndexer.suit_size(shape) + count - 1, count)
+            group_indices.append(index % radix)
+            index //= radix
+        group_indices.reverse()
+
+        rounds = [[] for _ in range(self.rounds)]
+        suit = 0
+        for (shape, count), group_index in zip(groups, group_indices):
+            # undo the combinations-with-repetition index, largest first
+            suit_indices = []
+            for i in range(count, 0, -1):
+                value = i - 1
+                while math.comb(value + 1, i) <= group_index:
+                    value += 1
+                group_index -= math.comb(value, i)
+                suit_indices.append(value - (i - 1))
+
+            for suit_index in suit_indices:
+                for r, mask in enumerate(HandIndexer.suit_masks(shape, suit_index)):
+                    rounds[r] += [CARD_INTS[rank * 4 + suit] for rank in range(13) if mask & (1 << rank)]
+                suit += 1
+
+        cards = [c for round_cards in rounds for c in round_cards]
+        return cards[:self.cards_per_round[0]], cards[self.cards_per_round[0]:]
+
+    @staticmethod
+    def suit_masks(shape, index):
+        """
+        Inverse of suit_index for a suit of the given shape.
+        """
+        colexes = []
+        available = 13 - sum(shape)
+        for cards in reversed(shape):
+            available += cards
+            radix = math.comb(available, cards)
+            colexes.append(index % radix)
+            index //= radix
+        colexes.reverse()
+
+        masks = []
+        used = 0
+        for cards, colex in zip(shape, colexes):
+            positions = []
+            for i in range(cards, 0, -1):
+                position = i - 1
+                while math.comb(position + 1, i) <= colex:
+                    position += 1
+                colex -= math.comb(position, i)
+                positions.append(position)
+            free = [rank for rank in range(13) if not used & (1 << rank)]
+            mask = 0
+            for position in positions:
+                mask |= 1 << free[position]
+            masks.append(mask)
+            used |= mask
+        return masks
+
+
+HandStrength = namedtuple('HandStrength', ['hs', 'ppot', 'npot', 'ehs'])
+
+HAND_STRENGTH_CACHE_SIZE = 4096
+
+def hand_strength(hand, board, opponent_range=None, lookahead=1):
+  """
+  Returns the HandStrength of hole cards on a flop, turn or river:
+      hs: chance of being ahead of the opponent range now, ties counting half
+      ppot: chance of getting ahead over the next lookahead cards when behind
+      npot: chance of falling behind over the next lookahead cards when ahead
+      ehs: effective hand strength, hs * (1 - npot) + (1 - hs) * ppot
+  Potentials are 0 on the river. A lookahead of 2 on the flop looks all the
+  way to the river but costs about 20x as much.
+
+  Against a uniform range the result only depends on the hand and board up
+  to suit isomorphism, so it is memoized in an LRU by the canonical hand and
+  board. Weighted ranges (see range_weights) are computed every time.
+  """
+  hand = to_card_ints(hand)
+  board = to_card_ints(board)
+  if not 3 <= len(board) <= 5:
+    raise ValueError("Hand strength needs a flop, turn or river")
+  lookahead = min(lookahead, 5 - len(board))
+  if opponent_range is None:
+    indexer = _board_set_indexer(len(board))
+    hand, board = indexer.unindex(indexer.index(hand, board))
+    return _uniform_hand_strength(tuple(hand), tuple(board), lookahead)
+  return _hand_strength(hand, board, range_weights(opponent_range), lookahead)
+
+@functools.lru_cache(maxsize=None)
+def _board_set_indexer(board_size):
+  # for features that treat the board as a set, so unlike hand_indexer the
+  # turn and river cards aren't rounds of their own
+  return HandIndexer([2, board_size] if board_size else [2])
+
+@functools.lru_cache(maxsize=HAND_STRENGTH_CACHE_SIZE)
+def _uniform_hand_strength(hand, board, lookahead):
+  return _hand_strength(list(hand), list(board), [1.0] * len(COMBOS), lookahead)
+
+def _hand_strength(hand, board, weights, lookahead):
+  known = set(CARD_INT_TO_INDEX[c] for c in hand + board)
+  opponents = [(weights[k], i, j, [CARD_INTS[i], CARD_INTS[j]]) for k, (i, j) in enumerate(COMBOS)
+               if weights[k] > 0 and i not in known and j not in known]
+  AHEAD, TIED, BEHIND = 0, 1, 2
+
+  context = BoardContext(board)
+  ours = context.evaluate(hand)
+  now = []
+  totals = [0.0, 0.0, 0.0]
+  for weight, _, _, opponent in opponents:
+    theirs = context.evaluate(opponent)
+    state = AHEAD if ours < theirs else TIED if ours == theirs else BEHIND
+    now.append(state)
+    totals[state] += weight
+  if sum(totals) == 0:
+    raise ValueError("Range is empty once blocked combos are removed")
+  hs = (totals[AHEAD] + totals[TIED] / 2) / sum(totals)
+  if lookahead == 0:
+    return HandStrength(hs, 0.0, 0.0, hs)
+
+  # potential[now][later] is the weight of opponent hands and runouts that
+  # go from one state to another
+  potential = [[0.0] * 3 for _ in range(3)]
+  deck = [c for c in range(52) if c not in known]
+  for runout in itertools.combinations(deck, lookahead):
+    runout_context = context.extend([CARD_INTS[c] for c in runout])
+    ours = runout_context.evaluate(hand)
+    for (weight, i, j, opponent), state in zip(opponents, now):
+      if i in runout or j in runout:
+        continue
+      theirs = runout_context.evaluate(opponent)
+      potential[state][AHEAD if ours < theirs else TIED if ours == theirs else BEHIND] += weight
+
+  behind = sum(potential[BEHIND]) + sum(potential[TIED]) / 2
+  ahead = sum(potential[AHEAD]) + sum(potential[TIED]) / 2
+  ppot = (potential[BEHIND][AHEAD] + potential[BEHIND][TIED] / 2 + potential[TIED][AHEAD] / 2) / behind if behind else 0.0
+  npot = (potential[AHEAD][BEHIND] + potential[TIED][BEHIND] / 2 + potential[AHEAD][TIED] / 2) / ahead if ahead else 0.0
+  return HandStrength(hs, ppot, npot, hs * (1 - npot) + (1 - hs) * ppot)
+
+
+def equity_histogram(hand, board, bins=30, rollouts=25, opponents=40, rng=random):
+  """
+  Returns, as a list of bins fractions, the histogram of the hand's river
+  equity against a random opponent over random runouts of the board to the
+  river. Each runout's equity is estimated from a sample of opponents. On
+  the river the histogram is all in the bin of the exact equity.
+  """
+  hand = to_card_ints(hand)
+  board = to_card_ints(board)
+  histogram = [0.0] * bins
+  if len(board) == 5:
+    value = river_ranking(board).equity(hand)
+    histogram[min(int(value * bins), bins - 1)] = 1.0
+    return histogram
+
+  known = set(CARD_INT_TO_INDEX[c] for c in hand + board)
+  deck = [CARD_INTS[c] for c in range(52) if c not in known]
+  for _ in range(rollouts):
+    runout = rng.sample(deck, 5 - len(board))
+    rest = [c for c in deck if c not in runout]
+    context = BoardContext(board + runout)
+    ours = context.evaluate(hand)
+    value = 0.0
+    for _ in range(opponents):
+      theirs = context.evaluate(rng.sample(rest, 2))
+      value += 1.0 if ours < theirs else 0.5 if ours == theirs else 0.0
+    histogram[min(int(value / opponents * bins), bins - 1)] += 1.0 / rollouts
+  return histogram
+
+def kmeans_emd(histograms, k, iterations=30, seed=0):
+  """
+  Clusters histograms (an (N, bins) NumPy array) into k clusters by earth
+  mover's distance, which for 1D histograms is the L1 distance between
+  their cumulative sums. Starts from k-means++ seeding and returns the
+  (k, bins) centroid histograms and each histogram's cluster.
+  """
+  rng = np.random.default_rng(seed)
+  cdfs = np.cumsum(histograms, axis=1)
+  k = min(k, len(cdfs))
+
+  centers = [cdfs[rng.integers(len(cdfs))]]
+  distances = np.abs(cdfs - centers[0]).sum(axis=1)
+  for _ in range(1, k):
+    if distances.sum() == 0:
+      centers.append(cdfs[rng.integers(len(cdfs))])
+    else:
+      centers.append(cdfs[rng.choice(len(cdfs), p=distances / distances.sum())])
+    distances = np.minimum(distances, np.abs(cdfs - centers[-1]).sum(axis=1))
+  centers = np.array(centers)
+
+  assignments = None
+  for _ in range(iterations):
+    new_assignments = nearest_centroids(cdfs, centers)
+    if assignments is not None and (new_assignments == assignments).all():
+      break
+    assignments = new_assignments
+    for c in range(k):
+      members = cdfs[assignments == c]
+      if len(members):
+        centers[c] = members.mean(axis=0)
+
+  return np.diff(centers, axis=1, prepend=0), assignments
+
+def nearest_centroids(cdfs, centroid_cdfs, chunk=4096):
+  """
+  Returns the index of the nearest centroid, by L1 distance, of each row of
+  cdfs, working through them a chunk at a time to bound memory.
+  """
+  nearest = np.empty(len(cdfs), dtype=np.int64)
+  for start in range(0, len(cdfs), chunk):
+    block = cdfs[start:start + chunk]
+    nearest[start:start + chunk] = np.abs(block[:, None, :] - centroid_cdfs[None, :, :]).sum(axis=2).argmin(axis=1)
+  return nearest
+
+
+class CardAbstraction(object):
+    """
+    Buckets (hand, board) situations on each street by clustering their
+    equity histograms with k-means under earth mover's distance, loaded
+    from the file written by `python3 handeval.py abstraction`. Buckets are
+    numbered from the lowest mean equity up.
+
+    Streets built with a table store the bucket of every suit-isomorphic
+    situation, so bucket() is a single index computation and lookup. The
+    flop, turn and river have far too many situations to enumerate in
+    Python, so by default they only store their centroids; bucket() computes
+    the histogram there with the build's seed, rollouts and opponents, so
+    it lands in the bucket the build would have assigned, and finds the
+    nearest centroid, memoized in an LRU. A call that misses the LRU costs
+    about 10ms on the flop and turn and 1ms on the river; build with a flop
+    table for O(1) flop lookups.
+
+    File layout (little endian, after a 28 byte header):
+        header:  magic 'HEAB', version, number of streets, seed, rollouts, opponents
+        streets: street, buckets, bins, table size (0 for none)
+        per street: float32 [buckets, bins] centroids, uint16 [table size] buckets
+    """
+    MAGIC = b'HEAB'
+    VERSION = 2
+    HEADER = struct.Struct('<4sIIqII')
+    STREET = struct.Struct('<IIII')
+    CACHE_SIZE = 65536
+
+    def __init__(self, filepath):
+        if np is None:
+            raise ImportError("CardAbstraction requires numpy")
+
+        with open(filepath, 'rb') as f:
+            magic, version, num_streets, self.seed, self.rollouts, self.opponents = CardAbstraction.HEADER.unpack(
+                f.read(CardAbstraction.HEADER.size))
+            if magic != CardAbstraction.MAGIC or version != CardAbstraction.VERSION:
+                raise ValueError("Not a version {} card abstraction: {}".format(CardAbstraction.VERSION, filepath))
+            streets = [CardAbstraction.STREET.unpack(f.read(CardAbstraction.STREET.size)) for _ in range(num_streets)]
+
+        self.centroids = {}
+        self.tables = {}
+        self.bins = {}
+        offset = CardAbstraction.HEADER.size + num_streets * CardAbstraction.STREET.size
+        for street, buckets, bins, table_size in streets:
+            self.bins[street] = bins
+            self.centroids[street] = np.memmap(filepath, dtype='<f4', mode='r', offset=offset, shape=(buckets, bins))
+            offset += 4 * buckets * bins
+            if table_size:
+                self.tables[street] = np.memmap(filepath, dtype='<u2', mode='r', offset=offset, shape=(table_size,))
+                offset += 2 * table_size
+        self._centroid_bucket = functools.lru_cache(maxsize=CardAbstraction.CACHE_SIZE)(self._centroid_bucket)
+
+    def bucket(self, hand, board):
+        """
+        Returns the bucket of hole cards on a board, both as the lists of
+        strings (or ints) the skeleton's RoundState carries.
+        """
+        street = len(board)
+        index = _board_set_indexer(street).index(hand, board)
+        if street in self.tables:
+            return int(self.tables[street][index])
+        return self._centroid_bucket(street, index)
+
+    def _centroid_bucket(self, street, index):
+        return int(_abstraction_chunk(street, [index], self.bins[street], self.rollouts, self.opponents, self.seed,
+                                      self.centroids[street])[0])
+
+    @staticmethod
+    def build(filepath, buckets, workers=1, bins=30, rollouts=25, opponents=40, sample_size=20000,
+              table_streets=(0,), seed=0):
+        """
+        Builds the abstraction and writes it to filepath. buckets maps each
+        street (0, 3, 4, 5) to its number of buckets. Centroids are fitted to
+        the histograms of up to sample_size random canonical situations per
+        street; streets in table_streets then have every situation assigned.
+        Only the preflop is tabled by default: a flop table means rollouts
+        for about 1.29M canonical flop situations, which takes hours to days.
+        Histograms are computed on a process pool in independently seeded
+        chunks, so results don't depend on the number of workers.
+        """
+        if np is None:
+            raise ImportError("building a card abstraction requires numpy")
+
+        rng = np.random.default_rng(seed)
+        streets = []
+        for street in sorted(buckets):
+            size = _board_set_indexer(street).size
+            if size <= sample_size:
+                sample = np.arange(size)
+            else:
+                sample = np.unique(rng.integers(size, size=sample_size))
+            chunks = [(street, sample[start:start + ABSTRACTION_CHUNK].tolist(), bins, rollouts, opponents, seed, None)
+                      for start in range(0, len(sample), ABSTRACTION_CHUNK)]
+            histograms = np.concatenate(list(_map_in_order(_abstraction_chunk, chunks, workers)))
+            centroids, _ = kmeans_emd(histograms, buckets[street], seed=seed)
+            centroids = centroids[np.argsort(centroids @ np.arange(bins))]
+            print('Street {}: fitted {} buckets to {} situations'.format(street, len(centroids), len(sample)))
+
+            table = np.zeros(0, dtype='<u2')
+            if street in table_streets:
+                chunks = [(street, list(range(start, min(start + ABSTRACTION_CHUNK, size))), bins, rollouts, opponents,
+                           seed, centroids) for start in range(0, size, ABSTRACTION_CHUNK)]
+                table = np.concatenate(list(_map_in_order(_abstraction_chunk, chunks, workers))).astype('<u2')
+                print('Street {}: assigned {} situations'.format(street, size))
+            streets.append((street, centroids.astype('<f4'), table))
+
+        with open(filepath, 'wb') as f:
+            f.write(CardAbstraction.HEADER.pack(CardAbstraction.MAGIC, CardAbstraction.VERSION, len(streets), seed,
+                                                rollouts, opponents))
+            for street, centroids, table in streets:
+                f.write(CardAbstraction.STREET.pack(street, centroids.shape[0], centroids.shape[1], len(table)))
+            for street, centroids, table in streets:
+                f.write(centroids.tobytes())
+                f.write(table.tobytes())
+
+
+# canonical situations per unit of work when building a CardAbstraction
+ABSTRACTION_CHUNK = 1000
+
+def _abstraction_chunk(street, indices, bins, rollouts, opponents, seed, centroids):
+  """
+  Computes the equity histograms of canonical situations, or their nearest
+  centroids if centroids are given. Each situation's rollouts are seeded
+  from (seed, index), so its histogram doesn't depend on the chunking.
+  """
+  indexer = _board_set_indexer(street)
+  histograms = np.zeros((len(indices), bins))
+  for row, index in enumerate(indices):
+    hand, board = indexer.unindex(index)
+    histograms[row] = equity_histogram(hand, board, bins, rollouts, opponents, random.Random('{}:{}'.format(seed, index)))
+  if centroids is None:
+    return histograms
+  return nearest_centroids(np.cumsum(histograms, axis=1), np.cumsum(centroids, axis=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python3 handeval.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seven_table = commands.add_parser('seven-table', help='Generate the memory-mapped 7-card rank table')
+    seven_table.add_argument('path', type=str, help='File to write the table to')
+
+    benchmark = commands.add_parser('benchmark', help='Report evaluate and evaluate_batch throughput')
+    benchmark.add_argument('--hands', type=int, default=1000000, help='Number of random 7-card hands')
+    benchmark.add_argument('--seed', type=int, default=0, help='Seed for the random hands')
+
+    preflop_table = commands.add_parser('preflop-table', help='Generate the preflop all-in equity matrices')
+    preflop_table.add_argument('path', type=str, help='File to write the table to')
+    preflop_table.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes to use')
+
+    check_exact = commands.add_parser('check-exact', help='Compare exact_equity against brute force enumeration')
+    check_exact.add_argument('--boards', type=int, default=10, help='Number of random flops and turns to add')
+    check_exact.add_argument('--seed', type=int, default=0, help='Seed for the random boards')
+
+    commands.add_parser('check-ranks', help='Compare the vectorized rank lookups against the scalar ones')
+
+    lookup_table = commands.add_parser('lookup-table', help='Save the 5-card lookup tables for fast loading')
+    lookup_table.add_argument('path', type=str, help='File to write the table to')
+
+    abstraction = commands.add_parser('abstraction', help='Build an equity histogram card abstraction')
+    abstraction.add_argument('path', type=str, help='File to write the abstraction to')
+    abstraction.add_argument('--buckets', type=str, default='169,200,200,200',
+                             help='Buckets for the preflop, flop, turn and river')
+    abstraction.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes to use')
+    abstraction.add_argument('--sample-size', type=int, default=20000, help='Situations to fit each street to')
+    abstraction.add_argument('--table-streets', type=str, default='0',
+                             help='Streets to store every bucket for; adding the flop (3) takes hours to days')
+    abstraction.add_argument('--seed', type=int, default=0, help='Seed for sampling and clustering')
+
+    args = parser.parse_args()
+    if args.command == 'abstraction':
+        buckets = dict(zip([0, 3, 4, 5], map(int, args.buckets.split(','))))
+        table_streets = [int(street) for street in args.table_streets.split(',') if street]
+        CardAbstraction.build(args.path, buckets, args.workers, sample_size=args.sample_size,
+                              table_streets=table_streets, seed=args.seed)
+        print('Wrote', args.path)
+    elif args.command == 'lookup-table':
+        get_lookup_table().save(args.path)
+        print('Wrote', args.path)
+    elif args.command == 'preflop-table':
+        PreflopEquity.generate(args.path, args.workers)
+        print('Wrote', args.path)
+    elif args.command == 'seven-table':
+        SevenCardEvaluator.generate(args.path)
+        print('Wrote', args.path)
+    elif args.command == 'benchmark':
+        run_benchmark(args.hands, args.seed)
+    elif args.command == 'check-ranks':
+        if not run_rank_check():
+            sys.exit(1)
+    elif args.command == 'check-exact':
+        if not run_exact_check(args.boards, args.seed):
+            sys.exit(1)
+
+
+# hands whose ranks repeat on the board in other suits, where a suit swap
+# could trade a hole card for a board card
+EXACT_CHECK_CASES = [
+  (['7h', '8h'], ['7s', '8s', '2c', 'Kd']),
+  (['7h', '8h'], ['7s', '8s', '2c']),
+  (['Ah', 'Kc'], ['Ac', 'Kh', '5d']),
+  (['Qs', 'Qd'], ['Qh', '9d', '9s', '3c']),
+  (['Jc', '4c'], ['Jd', '4h', '4s', 'Tc']),
+]
+
+def brute_force_equity(hand, board):
+  """
+  Equity of hole cards against a uniform random hand by plainly evaluating
+  every runout and opponent combo, as a reference for exact_equity.
+  """
+  evaluate = get_evaluator().evaluate
+  hand_cards = to_card_ints(hand)
+  board_cards = to_card_ints(board)
+  deck = [c for c in CARD_INTS if c not in hand_cards and c not in board_cards]
+  total = 0.0
+  count = 0
+  for runout in itertools.combinations(deck, 5 - len(board_cards)):
+    full_board = board_cards + list(runout)
+    ours = evaluate(hand_cards, full_board)
+    for opponent in itertools.combinations([c for c in deck if c not in runout], 2):
+      theirs = evaluate(list(opponent), full_board)
+      total += 1.0 if ours < theirs else 0.5 if ours == theirs else 0.0
+      count += 1
+  return total / count
+
+def run_exact_check(num_boards, seed):
+  """
+  Checks exact_equity against brute_force_equity on EXACT_CHECK_CASES and
+  on random flops and turns, printing any mismatch. Returns whether every
+  case agreed.
+  """
+  rng = random.Random(seed)
+  cases = list(EXACT_CHECK_CASES)
+  for _ in range(num_boards):
+    cards = rng.sample([rank + suit for rank in RANKS for suit in SUITS], 2 + rng.choice((3, 4)))
+    cases.append((cards[:2], cards[2:]))
+
+  ok = True
+  for hand, board in cases:
+    exact = exact_equity(hand, board).equity
+    expected = brute_force_equity(hand, board)
+    agrees = abs(exact - expected) < 1e-9
+    ok = ok and agrees
+    print('{} on {}: exact {:.6f}, brute force {:.6f}{}'.format(
+      ' '.join(hand), ' '.join(board), exact, expected, '' if agrees else '  MISMATCH'))
+  return ok
+
+
+def run_rank_check():
+  """
+  Checks get_rank_classes, classes_to_strings and
+  get_five_card_rank_percentages against their scalar versions on every
+  valid input, and that out of range inputs raise ValueError instead of
+  wrapping around. Prints any failure and returns whether all passed.
+  """
+  if np is None:
+    raise ImportError("the rank check requires numpy")
+
+  evaluator = get_evaluator()
+  ranks = np.arange(1, LookupTable.MAX_HIGH_CARD + 1)
+  classes = np.arange(1, 10)
+  ok = True
+  checks = [
+    ('get_rank_classes', evaluator.get_rank_classes(ranks).tolist(), [evaluator.get_rank_class(r) for r in ranks.tolist()]),
+    ('classes_to_strings', evaluator.classes_to_strings(classes).tolist(), [evaluator.class_to_string(c) for c in classes.tolist()]),
+    ('get_five_card_rank_percentages', evaluator.get_five_card_rank_percentages(ranks).tolist(),
+     [evaluator.get_five_card_rank_percentage(r) for r in ranks.tolist()]),
+  ]
+  for name, vectorized, scalar in checks:
+    if vectorized != scalar:
+      print('{}: differs from the scalar lookup'.format(name))
+      ok = False
+
+  bad_inputs = [
+    (evaluator.get_rank_classes, [-1, 0, LookupTable.MAX_HIGH_CARD + 1]),
+    (evaluator.classes_to_strings, [-1, 0, 10]),
+    (evaluator.get_five_card_rank_percentages, [-1, 0, LookupTable.MAX_HIGH_CARD + 1]),
+  ]
+  for function, values in bad_inputs:
+    for value in values:
+      try:
+        function(np.array([1, value]))
+      except ValueError:
+        continue
+      print('{}: accepted {}'.format(function.__name__, value))
+      ok = False
+
+  print('Rank lookups', 'agree' if ok else 'FAILED')
+  return ok
+
+
+def run_benchmark(num_hands, seed):
+    """
+    Times evaluate and evaluate_batch on the same random hands and prints
+    hands per second for each.
+    """
+    if np is None:
+        raise ImportError("the benchmark requires numpy")
+
+    evaluator = get_evaluator()
+    rng = np.random.default_rng(seed)
+    cards = np.argsort(rng.random((num_hands, 52)), axis=1)[:, :7]
+    card_ints = np.array(CARD_INTS, dtype=np.int64)[cards]
+
+    start = time.perf_counter()
+    batch_ranks = evaluator.evaluate_batch(card_ints[:, 2:], card_ints[:, :2])
+    batch_time = time.perf_counter() - start
+
+    # the per-hand loop is slow, so time a slice of it and scale up
+    sample = card_ints[:min(num_hands, 100000)].tolist()
+    start = time.perf_counter()
+    loop_ranks = [evaluator.evaluate(hand[:2], hand[2:]) for hand in sample]
+    loop_time = time.perf_counter() - start
+
+    assert loop_ranks == batch_ranks[:len(sample)].tolist(), "evaluate_batch disagrees with evaluate"
+    print('evaluate:       {:>12,.0f} hands/s'.format(len(sample) / loop_time))
+    print('evaluate_batch: {:>12,.0f} hands/s ({:,} hands in {:.2f}s)'.format(num_hands / batch_time, num_hands, batch_time))
+
+
+if __name__ == '__main__':
+    main()
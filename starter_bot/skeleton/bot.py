@@ -50,3 +50,17 @@ class Bot():
         Your action.
         '''
         raise NotImplementedError('get_action')
+
+    def get_actions(self, requests):
+        '''
+        Called with every table that is waiting on an action at once, when the engine
+        runs several tables (game_state.table tells them apart). Override this to decide
+        for them all together; by default it calls get_action for each in turn.
+
+        Arguments:
+        requests: a list of (game_state, round_state, active) tuples.
+
+        Returns:
+        A list of your actions, one per request.
+        '''
+        return [self.get_action(game_state, round_state, active) for game_state, round_state, active in requests]
@@ -3,107 +3,236 @@ The infrastructure for interacting with the engine.
 '''
 import argparse
 import socket
+import struct
+import signal
+import sys
+import os
 from .actions import FoldAction, CallAction, CheckAction, RaiseAction
 from .states import GameState, TerminalState, RoundState
 from .states import STARTING_STACK, BIG_BLIND, SMALL_BLIND
 from .bot import Bot
 
+# the binary protocol, which the engine offers at connect (see engine.py)
+BINARY_OFFER = 'V1'
+TABLES_OFFER = 'M' #the multi-table extension, offered in text before the binary protocol
+FRAME = struct.Struct('<H')
+INT32 = struct.Struct('<i')
+DOUBLE = struct.Struct('<d')
+CARDS = [rank + suit for rank in '23456789TJQKA' for suit in 'cdhs'] #by deck index
+
+
+def decode_text(clause):
+    '''
+    Decodes one text clause into a (code, value) pair.
+    '''
+    code, value = clause[0], clause[1:]
+    if code in 'HBO':
+        return code, value.split(',')
+    if code == 'T':
+        return code, float(value)
+    if code in 'PRDIM':
+        return code, int(value)
+    return code, value or None
+
+
+def decode_binary(payload):
+    '''
+    Decodes a binary message into a list of (code, value) pairs.
+    '''
+    clauses = []
+    i = 0
+    while i < len(payload):
+        code = chr(payload[i])
+        i += 1
+        if code == 'T':
+            value = DOUBLE.unpack_from(payload, i)[0]
+            i += DOUBLE.size
+        elif code in 'HBO':
+            value = [CARDS[card] for card in payload[i + 1:i + 1 + payload[i]]]
+            i += 1 + payload[i]
+        elif code in 'PRDIM':
+            value = INT32.unpack_from(payload, i)[0]
+            i += INT32.size
+        else:
+            value = None
+        clauses.append((code, value))
+    return clauses
+
 
 class Runner():
     '''
     Interacts with the engine.
     '''
 
-    def __init__(self, pokerbot, socketfile):
+    def __init__(self, pokerbot, socketfile, sock=None):
         self.pokerbot = pokerbot
         self.socketfile = socketfile
+        self.sock = sock #needed to switch to the binary protocol
+        self.binary = False
+        self.multi = False #whether messages carry table ids
+        self.tables = {} #table id to its [game_state, round_state, active, round_flag]
 
     def receive(self):
         '''
-        Generator for incoming messages from the engine.
+        Generator for incoming messages from the engine, as lists of (code, value) clauses.
         '''
         while True:
-            packet = self.socketfile.readline().strip().split(' ')
-            if not packet:
+            if self.binary:
+                header = self.socketfile.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    break
+                yield decode_binary(self.socketfile.read(FRAME.unpack(header)[0]))
+                continue
+            line = self.socketfile.readline()
+            if not line: #the engine has gone
                 break
-            yield packet
+            yield [decode_text(clause) for clause in line.strip().split(' ')]
+
+    def accept_binary(self):
+        '''
+        Accepts the engine's offer of the binary protocol, if we have the socket to switch.
+        '''
+        if self.sock is None:
+            return False
+        self.socketfile.write(BINARY_OFFER + '\n')
+        self.socketfile.flush()
+        self.socketfile.close()
+        self.socketfile = self.sock.makefile('rwb')
+        self.binary = True
+        return True
+
+    def accept_tables(self, count):
+        '''
+        Accepts the engine's offer to play count tables over this connection.
+        '''
+        self.socketfile.write(TABLES_OFFER + str(count) + '\n')
+        self.socketfile.flush()
+        self.multi = True
 
-    def send(self, action):
+    @staticmethod
+    def encode(action):
         '''
-        Encodes an action and sends it to the engine.
+        Returns the (code, value) clause for an action.
         '''
         if isinstance(action, FoldAction):
-            code = 'F'
-        elif isinstance(action, CallAction):
-            code = 'C'
-        elif isinstance(action, CheckAction):
-            code = 'K'
-        else:  # isinstance(action, RaiseAction)
-            code = 'R' + str(action.amount)
-        self.socketfile.write(code + '\n')
+            return 'F', None
+        if isinstance(action, CallAction):
+            return 'C', None
+        if isinstance(action, CheckAction):
+            return 'K', None
+        return 'R', int(action.amount)  # isinstance(action, RaiseAction)
+
+    def send(self, clauses):
+        '''
+        Sends a list of (code, value) clauses to the engine.
+        '''
+        if self.binary:
+            payload = b''.join(code.encode() + (b'' if value is None else INT32.pack(value)) for code, value in clauses)
+            self.socketfile.write(FRAME.pack(len(payload)) + payload)
+        else:
+            self.socketfile.write(' '.join(code + ('' if value is None else str(value)) for code, value in clauses) + '\n')
         self.socketfile.flush()
 
+    def update(self, table, clauses):
+        '''
+        Applies one table's clauses to its game tree, calling handle_new_round and
+        handle_round_over as rounds start and end. Returns False once the engine quits.
+        '''
+        if table not in self.tables:
+            self.tables[table] = [GameState(0, 0., 1, table), None, 0, True]
+        game_state, round_state, active, round_flag = self.tables[table]
+        for code, value in clauses:
+            if code == 'T':
+                game_state = GameState(game_state.bankroll, value, game_state.round_num, table)
+            elif code == 'P':
+                active = value
+            elif code == 'H':
+                hands = [[], []]
+                hands[active] = value
+                pips = [SMALL_BLIND, BIG_BLIND]
+                stacks = [STARTING_STACK - SMALL_BLIND, STARTING_STACK - BIG_BLIND]
+                round_state = RoundState(0, 0, pips, stacks, hands, [], None)
+                if round_flag:
+                    self.pokerbot.handle_new_round(game_state, round_state, active)
+                    round_flag = False
+            elif code == 'F':
+                round_state = round_state.proceed(FoldAction())
+            elif code == 'C':
+                round_state = round_state.proceed(CallAction())
+            elif code == 'K':
+                round_state = round_state.proceed(CheckAction())
+            elif code == 'R':
+                round_state = round_state.proceed(RaiseAction(value))
+            elif code == 'B':
+                round_state = RoundState(round_state.button, round_state.street, round_state.pips, round_state.stacks,
+                                         round_state.hands, value, round_state.previous_state)
+            elif code == 'O':
+                # backtrack
+                round_state = round_state.previous_state
+                revised_hands = list(round_state.hands)
+                revised_hands[1-active] = value
+                # rebuild history
+                round_state = RoundState(round_state.button, round_state.street, round_state.pips, round_state.stacks,
+                                         revised_hands, round_state.deck, round_state.previous_state)
+                round_state = TerminalState([0, 0], round_state)
+            elif code == 'D':
+                assert isinstance(round_state, TerminalState)
+                delta = value
+                deltas = [-delta, -delta]
+                deltas[active] = delta
+                round_state = TerminalState(deltas, round_state.previous_state)
+                game_state = GameState(game_state.bankroll + delta, game_state.game_clock, game_state.round_num, table)
+                self.pokerbot.handle_round_over(game_state, round_state, active)
+                game_state = GameState(game_state.bankroll, game_state.game_clock, game_state.round_num + 1, table)
+                round_flag = True
+            elif code == 'Q':
+                return False
+        self.tables[table] = [game_state, round_state, active, round_flag]
+        return True
+
     def run(self):
         '''
-        Reconstructs the game tree based on the action history received from the engine.
+        Reconstructs the game tree of each table based on the action history received from the engine,
+        and answers every table waiting on an action with one batch of get_actions.
         '''
-        game_state = GameState(0, 0., 1)
-        round_state = None
-        active = 0
-        round_flag = True
         for packet in self.receive():
-            for clause in packet:
-                if clause[0] == 'T':
-                    game_state = GameState(game_state.bankroll, float(clause[1:]), game_state.round_num)
-                elif clause[0] == 'P':
-                    active = int(clause[1:])
-                elif clause[0] == 'H':
-                    hands = [[], []]
-                    hands[active] = clause[1:].split(',')
-                    pips = [SMALL_BLIND, BIG_BLIND]
-                    stacks = [STARTING_STACK - SMALL_BLIND, STARTING_STACK - BIG_BLIND]
-                    round_state = RoundState(0, 0, pips, stacks, hands, [], None)
-                    if round_flag:
-                        self.pokerbot.handle_new_round(game_state, round_state, active)
-                        round_flag = False
-                elif clause[0] == 'F':
-                    round_state = round_state.proceed(FoldAction())
-                elif clause[0] == 'C':
-                    round_state = round_state.proceed(CallAction())
-                elif clause[0] == 'K':
-                    round_state = round_state.proceed(CheckAction())
-                elif clause[0] == 'R':
-                    round_state = round_state.proceed(RaiseAction(int(clause[1:])))
-                elif clause[0] == 'B':
-                    round_state = RoundState(round_state.button, round_state.street, round_state.pips, round_state.stacks,
-                                             round_state.hands, clause[1:].split(','), round_state.previous_state)
-                elif clause[0] == 'O':
-                    # backtrack
-                    round_state = round_state.previous_state
-                    revised_hands = list(round_state.hands)
-                    revised_hands[1-active] = clause[1:].split(',')
-                    # rebuild history
-                    round_state = RoundState(round_state.button, round_state.street, round_state.pips, round_state.stacks,
-                                             revised_hands, round_state.deck, round_state.previous_state)
-                    round_state = TerminalState([0, 0], round_state)
-                elif clause[0] == 'D':
-                    assert isinstance(round_state, TerminalState)
-                    delta = int(clause[1:])
-                    deltas = [-delta, -delta]
-                    deltas[active] = delta
-                    round_state = TerminalState(deltas, round_state.previous_state)
-                    game_state = GameState(game_state.bankroll + delta, game_state.game_clock, game_state.round_num)
-                    self.pokerbot.handle_round_over(game_state, round_state, active)
-                    game_state = GameState(game_state.bankroll, game_state.game_clock, game_state.round_num + 1)
-                    round_flag = True
-                elif clause[0] == 'Q':
+            if packet == [('V', BINARY_OFFER[1:])] and self.accept_binary():
+                continue
+            if len(packet) == 1 and packet[0][0] == TABLES_OFFER and not self.binary:
+                self.accept_tables(packet[0][1])
+                continue
+            if packet == [('N', None)]:  # a new game on this connection, with a fresh pokerbot
+                self.tables = {}
+                self.pokerbot = type(self.pokerbot)()
+                self.send([('N', None)])
+                continue
+            messages = [(0, [])] #(table, clauses), split where I clauses start a table's message
+            for code, value in packet:
+                if code == 'I':
+                    messages.append((value, []))
+                else:
+                    messages[-1][1].append((code, value))
+            replies = []
+            requests = []
+            for table, clauses in messages:
+                if not clauses and self.multi:
+                    continue
+                if not self.update(table, clauses):
                     return
-            if round_flag:  # ack the engine
-                self.send(CheckAction())
-            else:
-                assert active == round_state.button % 2
-                action = self.pokerbot.get_action(game_state, round_state, active)
-                self.send(action)
+                game_state, round_state, active, round_flag = self.tables[table]
+                if round_flag:  # ack the engine
+                    replies.append((table, CheckAction()))
+                else:
+                    assert active == round_state.button % 2
+                    replies.append((table, None))
+                    requests.append((game_state, round_state, active))
+            actions = iter(self.pokerbot.get_actions(requests) if requests else [])
+            clauses = []
+            for table, action in replies:
+                if self.multi:
+                    clauses.append(('I', table))
+                clauses.append(Runner.encode(action if action is not None else next(actions)))
+            self.send(clauses)
 
 
 def parse_args():
@@ -112,21 +241,74 @@ def parse_args():
     '''
     parser = argparse.ArgumentParser(prog='python3 player.py')
     parser.add_argument('--host', type=str, default='localhost', help='Host to connect to, defaults to localhost')
-    parser.add_argument('port', type=int, help='Port on host to connect to')
-    return parser.parse_args()
+    parser.add_argument('--unix', type=str, default=None, help='Unix domain socket to connect to instead')
+    parser.add_argument('--fd', type=int, default=None, help='Inherited file descriptor of an already connected socket')
+    parser.add_argument('--serve', type=int, default=None,
+                        help='Inherited file descriptor of a listening socket to serve games from as a fork server')
+    parser.add_argument('port', type=int, nargs='?', help='Port on host to connect to')
+    args = parser.parse_args()
+    if args.port is None and args.unix is None and args.fd is None and args.serve is None:
+        parser.error('one of port, --unix, --fd or --serve is required')
+    return args
 
 def run_bot(pokerbot, args):
     '''
     Runs the pokerbot.
     '''
     assert isinstance(pokerbot, Bot)
+    if args.serve is not None:
+        serve(pokerbot, socket.socket(fileno=args.serve))
+        return
     try:
-        sock = socket.create_connection((args.host, args.port))
+        if args.fd is not None:
+            sock = socket.socket(fileno=args.fd)
+        elif args.unix is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(args.unix)
+        else:
+            sock = socket.create_connection((args.host, args.port))
     except OSError:
-        print('Could not connect to {}:{}'.format(args.host, args.port))
+        print('Could not connect to {}'.format(args.fd if args.fd is not None else args.unix or '{}:{}'.format(args.host, args.port)))
         return
+    play(pokerbot, sock)
+
+def play(pokerbot, sock):
+    '''
+    Plays the engine over a connected socket until it quits.
+    '''
     socketfile = sock.makefile('rw')
-    runner = Runner(pokerbot, socketfile)
+    runner = Runner(pokerbot, socketfile, sock)
     runner.run()
-    socketfile.close()
+    runner.socketfile.close()
     sock.close()
+
+def serve(pokerbot, listener):
+    '''
+    Serves games as a fork server: for each game the engine asks for, forks a copy of this
+    process, pokerbot and loaded modules included, with the engine's pipe as its output.
+    '''
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # finished games need no reaping
+    while True:
+        sock, _ = listener.accept()
+        request, fds, _, _ = socket.recv_fds(sock, 1, 1)
+        if request == b'F' and fds:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    listener.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    os.dup2(fds[0], 1)
+                    os.dup2(fds[0], 2)
+                    os.close(fds[0])
+                    play(pokerbot, sock)
+                finally:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(0)
+            os.close(fds[0])
+            sock.sendall('{}\n'.format(pid).encode())
+        elif request == b'P':  # the engine waits for this before asking for games
+            sock.sendall(b'P')
+        sock.close()
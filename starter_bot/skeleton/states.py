@@ -4,7 +4,7 @@ Encapsulates game and round state information for the player.
 from collections import namedtuple
 from .actions import FoldAction, CallAction, CheckAction, RaiseAction
 
-GameState = namedtuple('GameState', ['bankroll', 'game_clock', 'round_num'])
+GameState = namedtuple('GameState', ['bankroll', 'game_clock', 'round_num', 'table'], defaults=[0]) #table is 0 unless the engine runs several
 TerminalState = namedtuple('TerminalState', ['deltas', 'previous_state'])
 
 NUM_ROUNDS = 1000
@@ -0,0 +1,205 @@
+'''
+Round-robin tournaments between many pokerbots, rated as the results come in.
+
+Usage: python3 tournament.py <directory of bot folders> [--rounds N] [--matches M]
+'''
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import itertools
+import argparse
+import random
+import math
+import os
+
+from engine import *
+
+ELO_START = 1500.
+ELO_K = 16. #rating points at stake in each match
+DECIDED_Z = 3. #a pairing needs no more matches once its win rate is this many standard errors from 0
+
+
+class Tournament():
+    '''
+    Schedules matches between every pair of bots, most uncertain pairings first, and keeps
+    Elo ratings and per-pairing win rates up to date as matches finish.
+    '''
+
+    def __init__(self, bots, rounds, max_matches, output, seed):
+        self.bots = bots #list of (name, path)
+        self.rounds = rounds #rounds in each match
+        self.max_matches = max_matches #matches each pairing may be played, if it stays undecided
+        self.output = output #directory for game and bot logs
+        self.seed = seed
+        self.pairings = list(itertools.combinations(range(len(bots)), 2))
+        self.stats = {pairing: [0, 0, 0, 0] for pairing in self.pairings} #matches, deltas, sum and sum of squares of the first bot's deltas
+        self.in_flight = {pairing: 0 for pairing in self.pairings}
+        self.ratings = [ELO_START] * len(bots)
+        self.bankrolls = [0] * len(bots)
+        self.matches = 0 #matches scheduled so far, which numbers them
+
+    def z_score(self, pairing):
+        '''
+        Returns how many standard errors the pairing's win rate is away from 0.
+        '''
+        _, n, total, squares = self.stats[pairing]
+        if n < 2:
+            return 0.
+        mean = total / n
+        variance = max(squares - n * mean * mean, 0.) / (n - 1)
+        if variance == 0.:
+            return math.inf if mean != 0 else 0.
+        return abs(mean) / math.sqrt(variance / n)
+
+    def next_pairing(self):
+        '''
+        Returns the unplayed or least decided pairing that can still use a match, or None.
+        '''
+        candidates = []
+        for pairing in self.pairings:
+            matches = self.stats[pairing][0] + self.in_flight[pairing]
+            z = self.z_score(pairing) #0 until there are results, so new pairings go first
+            if matches < self.max_matches and (self.stats[pairing][0] == 0 or z < DECIDED_Z):
+                candidates.append((z, matches, pairing))
+        return min(candidates)[2] if candidates else None
+
+    def record(self, pairing, swapped, result):
+        '''
+        Adds a finished match to the pairing's statistics, the bankrolls and the ratings.
+        '''
+        a, b = pairing
+        bankrolls = result.bankrolls[::-1] if swapped else result.bankrolls
+        sign = -1 if swapped else 1 #deltas are the first seated player's
+        stats = self.stats[pairing]
+        stats[0] += 1
+        stats[1] += len(result.deltas)
+        stats[2] += sign * sum(result.deltas)
+        stats[3] += sum(delta * delta for delta in result.deltas)
+        self.bankrolls[a] += bankrolls[0]
+        self.bankrolls[b] += bankrolls[1]
+        score = 1. if bankrolls[0] > 0 else 0. if bankrolls[0] < 0 else 0.5
+        expected = 1. / (1. + 10. ** ((self.ratings[b] - self.ratings[a]) / 400.))
+        self.ratings[a] += ELO_K * (score - expected)
+        self.ratings[b] -= ELO_K * (score - expected)
+        mbb = 1000 * stats[2] / stats[1] / (2 if DUPLICATE else 1) / BIG_BLIND #duplicate deltas cover two hands
+        print('{} vs {}: {}{} - {:.1f} mbb/hand over {} matches (z {:.1f})'.format(
+            self.bots[a][0], self.bots[b][0], '+' if bankrolls[0] > 0 else '', bankrolls[0],
+            mbb, stats[0], self.z_score(pairing)))
+
+    def table(self):
+        '''
+        Returns the rating table as lines of text, best first.
+        '''
+        lines = ['{:<4} {:<24} {:>8} {:>12}'.format('#', 'Bot', 'Elo', 'Bankroll')]
+        order = sorted(range(len(self.bots)), key=lambda bot: -self.ratings[bot])
+        for place, bot in enumerate(order, 1):
+            lines.append('{:<4} {:<24} {:>8.1f} {:>12}'.format(place, self.bots[bot][0], self.ratings[bot], self.bankrolls[bot]))
+        return lines
+
+    def run(self, workers=None):
+        '''
+        Builds every bot once, and under FORK_SERVER starts each as a fork server, then plays
+        matches in a process pool until every pairing has been decided or played max_matches times.
+        '''
+        os.makedirs(self.output, exist_ok=True)
+        workers = workers or os.cpu_count()
+        servers, addresses = [], {}
+        if not HEADLESS:
+            with ProcessPoolExecutor(workers) as executor:
+                builds = [(name, path, self.output) for name, path in self.bots]
+                for (name, _), built in zip(self.bots, executor.map(build_bot, builds)):
+                    if not built:
+                        print(name, 'failed to build, so it will only check or fold')
+            if FORK_SERVER:
+                servers, addresses = start_fork_servers(self.bots, self.output)
+        with ProcessPoolExecutor(workers, initializer=start_bot_worker, initargs=(addresses,)) as executor: #workers keep their bots under REUSE_BOTS
+            futures = {}
+            while True:
+                while len(futures) < workers: #keep every worker busy
+                    pairing = self.next_pairing()
+                    if pairing is None:
+                        break
+                    swapped = self.stats[pairing][0] % 2 == 1 #alternate who is seated first
+                    bots = [self.bots[bot] for bot in (pairing[::-1] if swapped else pairing)]
+                    match = (self.matches, bots, self.rounds, self.seed, self.output)
+                    futures[executor.submit(run_match, match)] = (pairing, swapped)
+                    self.in_flight[pairing] += 1
+                    self.matches += 1
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pairing, swapped = futures.pop(future)
+                    self.in_flight[pairing] -= 1
+                    self.record(pairing, swapped, future.result())
+                    with open(os.path.join(self.output, 'ratings.txt'), 'w') as ratings_file:
+                        ratings_file.write('\n'.join(self.table()) + '\n')
+        stop_fork_servers(servers, addresses)
+        print()
+        print('\n'.join(self.table()))
+
+
+def build_bot(bot):
+    '''
+    Builds one bot, (name, path, output), writing its build output to a log. Returns whether
+    its commands could be loaded.
+    '''
+    name, path, output = bot
+    player = Player(name, path)
+    player.log_filename = os.path.join(output, name + '.build.txt')
+    player.build()
+    player.stop()
+    return player.commands is not None
+
+
+def run_match(match):
+    '''
+    Plays one match, (index, bots, rounds, seed, output), between two built bots. Returns a MatchResult.
+    '''
+    index, bots, rounds, seed, output = match
+    if SEVEN_CARD_TABLE is not None:
+        handeval.use_seven_card_table(SEVEN_CARD_TABLE)
+    handeval.warm_up()
+    players = []
+    for name, path in bots:
+        log_filename = os.path.join(output, '{}.{}.txt'.format(name, index))
+        if HEADLESS:
+            player = LocalPlayer(name, path)
+            player.log_filename = log_filename
+            player.build() #importing is all the building a headless bot needs
+            player.run()
+        else:
+            player = claim_player(name, path, log_filename) #already built
+        players.append(player)
+    game = Game(random.Random('{}:{}'.format(seed, index)), [player.name for player in players])
+    return play_rounds(game, players, 1, rounds, os.path.join(output, '{}.{}.txt'.format(GAME_LOG_FILENAME, index)))
+
+
+def find_bots(directory):
+    '''
+    Returns (name, path) of every bot folder in directory.
+    '''
+    marker = 'player.py' if HEADLESS else 'commands.json'
+    return [(name, os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+            if os.path.isfile(os.path.join(directory, name, marker))]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python3 tournament.py')
+    parser.add_argument('directory', help='Directory with one folder per bot')
+    parser.add_argument('--rounds', type=int, default=NUM_ROUNDS, help='Rounds in each match')
+    parser.add_argument('--matches', type=int, default=1,
+                        help='Most matches per pairing, played while its winner is still uncertain')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to the number of CPUs')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the matches\' decks')
+    parser.add_argument('--output', type=str, default='tournament', help='Directory for logs and the rating table')
+    args = parser.parse_args()
+    bots = find_bots(args.directory)
+    if len(bots) < 2:
+        print('Found', len(bots), 'bots in', args.directory, '- need at least 2')
+        return
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    print('Tournament between {} bots, seed {}'.format(len(bots), seed))
+    Tournament(bots, args.rounds, args.matches, args.output, seed).run(args.workers)
+
+
+if __name__ == '__main__':
+    main()